@@ -1,23 +1,33 @@
-import subprocess
 import os
 import platform
+import sys
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine")
 
 def clear_screen():
+    if not sys.stdout.isatty():
+        return
     system = platform.system()
     if system == "Windows":
         os.system('cls')
     else:
-        os.system('clear')
+        print("\033[H\033[2J", end="", flush=True)
 
-def run_cho():
-    command = ['python', 'cho.py']
-    print(f"Running command: {' '.join(command)}")
-    subprocess.run(command)
+def run_cho(argv):
+    # cho runs in this interpreter, so the launcher adds no second Python startup
+    sys.path.insert(0, ENGINE_DIR)
+    import cho
+    return cho.main(argv)
 
-def main():
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--import-time" in argv:
+        sys.path.insert(0, ENGINE_DIR)
+        import importtime
+        importtime.enable()
     clear_screen()
     print("Starting cho.py...")
-    run_cho()
+    run_cho(argv)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,130 @@
+import shutil
+import struct
+import subprocess
+from cache import file_digest
+
+DEFAULT_SR = 22050
+
+class FfmpegStream:
+    """Mono float32 samples of a file at its own sample rate, read from an ffmpeg pipe.
+
+    ffmpeg decodes any container (opus, m4a, webm...) straight into the pipe, with no
+    intermediate file; the sample rate is read from the header of the WAV it writes.
+    """
+
+    def __init__(self, audio_file):
+        self.audio_file = audio_file
+        command = ["ffmpeg", "-nostdin", "-v", "error", "-i", audio_file, "-vn", "-map_metadata", "-1",
+                   "-ac", "1", "-c:a", "pcm_f32le", "-f", "wav", "-"]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            self.sr = self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _fail(self):
+        self._process.stdout.close()
+        stderr = self._process.stderr.read().decode(errors="replace").strip()
+        self._process.wait()
+        raise RuntimeError(f"ffmpeg could not decode {self.audio_file}: {stderr or 'no audio'}")
+
+    def _read_header(self):
+        stdout = self._process.stdout
+        if stdout.read(12)[8:12] != b"WAVE":
+            self._fail()
+        sr = None
+        while True:
+            chunk = stdout.read(8)
+            if len(chunk) < 8:
+                self._fail()
+            chunk_id, size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"data":
+                # a pipe cannot be rewound, so the data size is left unset and the samples run to the end
+                if sr is None:
+                    self._fail()
+                return sr
+            body = stdout.read(size + size % 2)
+            if chunk_id == b"fmt ":
+                sr = struct.unpack("<I", body[4:8])[0]
+
+    def blocks(self, block_size):
+        """Blocks of block_size samples, the last one shorter."""
+        import numpy as np
+        try:
+            while True:
+                data = self._process.stdout.read(block_size * 4)
+                if data:
+                    yield np.frombuffer(data[:len(data) // 4 * 4], dtype=np.float32).copy()
+                if len(data) < block_size * 4:
+                    break
+            if self._process.wait() != 0:
+                self._fail()
+        finally:
+            self.close()
+
+    def read(self):
+        import numpy as np
+        return np.concatenate(list(self.blocks(1 << 20)) or [np.zeros(0, dtype=np.float32)])
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+        self._process.stderr.close()
+
+def ffmpeg_decode(audio_file):
+    stream = FfmpegStream(audio_file)
+    return stream.read(), stream.sr
+
+class AudioContext:
+    def __init__(self, audio_file, sr=DEFAULT_SR):
+        self.audio_file = audio_file
+        self.sr = sr
+        self._native = None
+        self._native_sr = None
+        self._buffers = {}
+        self._digest = None
+
+    @classmethod
+    def from_buffer(cls, y, sr):
+        audio = cls(None, sr=sr)
+        audio._native, audio._native_sr = y, sr
+        return audio
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = file_digest(self.audio_file)
+        return self._digest
+
+    def _decode(self):
+        # the file is decoded once, at its own rate; every rate the stages ask for is resampled from that
+        if self._native is None:
+            if shutil.which("ffmpeg"):
+                self._native, self._native_sr = ffmpeg_decode(self.audio_file)
+            else:
+                import librosa
+                self._native, self._native_sr = librosa.load(self.audio_file, sr=None, mono=True)
+        return self._native, self._native_sr
+
+    def load(self, sr=None):
+        sr = sr or self.sr
+        if sr not in self._buffers:
+            y, native_sr = self._decode()
+            if native_sr != sr:
+                import librosa
+                y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+            self._buffers[sr] = y
+        return self._buffers[sr], sr
+
+    def release(self):
+        self._native = None
+        self._native_sr = None
+        self._buffers.clear()
+
+def as_audio_context(audio, sr=DEFAULT_SR):
+    if isinstance(audio, AudioContext):
+        return audio
+    return AudioContext(audio, sr=sr)
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from workers import bounded_map
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a', '.opus', '.webm', '.aac')
+
+def song_from_path(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if " - " in name:
+        artist, title = name.split(" - ", 1)
+    else:
+        artist, title = "Unknown", name
+    return {"path": path, "artist": artist.strip(), "title": title.strip()}
+
+def _song_from_record(record, base_dir):
+    path = record.get("path", "")
+    if path and not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    song = song_from_path(path)
+    song["artist"] = record.get("artist") or song["artist"]
+    song["title"] = record.get("title") or song["title"]
+    if record.get("url"):
+        # artist and title left blank are filled in from the video's info
+        song.update(url=record["url"], artist=record.get("artist") or None, title=record.get("title") or None)
+    return song
+
+def collect_songs(source):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith(AUDIO_EXTENSIONS):
+                    yield song_from_path(os.path.join(root, file))
+    elif source.lower().endswith('.csv'):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8", newline="") as f:
+            for record in csv.DictReader(f):
+                yield _song_from_record(record, base_dir)
+    elif source.lower().endswith('.jsonl'):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield _song_from_record(json.loads(line), base_dir)
+    else:
+        for path in sorted(glob.glob(source, recursive=True)):
+            if os.path.isfile(path):
+                yield song_from_path(path)
+
+def _analyze(song, use_cache=True, stream=False):
+    from cho import analyze_song
+    try:
+        song_entry, html_file = analyze_song(song["path"], song["artist"], song["title"], verbose=False,
+                                             use_cache=use_cache, stream=stream)
+        return song, song_entry, html_file, None
+    except Exception as e:
+        return song, None, None, f"{type(e).__name__}: {e}"
+
+def run_batch(songs, workers=None, max_pending=None, generate_report=True, use_cache=True, db=None,
+              stream=False):
+    from cho import save_song_entry
+    from db import ReportUpdater
+    from store import open_store
+    from music import CHORDINO_PARAMS
+    from extractor_pool import init_chordino_worker
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    succeeded, failed = [], []
+    started = time.time()
+    store = open_store(db)
+
+    # only a bounded number of songs is in flight at once, and the db is written
+    # from this process alone, as results arrive
+    # the statistics are written every few songs and once more at the end, not after every song
+    report = ReportUpdater(store) if generate_report else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_chordino_worker,
+                             initargs=(CHORDINO_PARAMS,)) as executor:
+        analyzed = bounded_map(lambda song: executor.submit(_analyze, song, use_cache, stream), songs, max_pending)
+        for song, result, error in analyzed:
+            if error is None:
+                song, song_entry, html_file, error = result
+            if error is None:
+                try:
+                    save_song_entry(song_entry, store)
+                    if report is not None:
+                        report.add(song_entry)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+
+            if error is None:
+                succeeded.append(song)
+                print(f"[ok] {song['artist']} - {song['title']} -> {html_file}")
+            else:
+                failed.append((song, error))
+                print(f"[failed] {song['path']}: {error}")
+    if report is not None:
+        report.close()
+
+    summary = {
+        "succeeded": len(succeeded),
+        "failed": len(failed),
+        "elapsed": time.time() - started,
+        "failures": [{"path": song["path"], "error": error} for song, error in failed],
+    }
+    print_summary(summary)
+    return summary
+
+def print_summary(summary):
+    print(f"Batch complete: {summary['succeeded']} analyzed, {summary['failed']} failed "
+          f"in {summary['elapsed']:.1f}s")
+    for failure in summary["failures"]:
+        print(f"  - {failure['path']}: {failure['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a directory, glob or manifest of songs without prompts.")
+    parser.add_argument("source", help="Directory, glob pattern, or CSV/JSONL manifest with path, artist, title")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Maximum number of songs in flight at once (default: 2 per worker)")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every analysis stage, ignoring the cache")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Analyze each file in overlapping windows to keep memory flat on very long recordings")
+    parser.add_argument("--no-report", action="store_true", help="Do not update chords_database.html")
+    args = parser.parse_args()
+
+    summary = run_batch(collect_songs(args.source), workers=args.workers, max_pending=args.max_pending,
+                        generate_report=not args.no_report, use_cache=not args.no_cache,
+                        db=args.db, stream=args.stream)
+    raise SystemExit(1 if summary["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
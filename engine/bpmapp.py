@@ -1,60 +1,15 @@
-import librosa
-import numpy as np
-from scipy import stats
 import os
+from cache import AnalysisCache
+from rhythm import get_rhythm
 
-def smooth_intervals(intervals, window_size=5):
-    if len(intervals) < window_size:
-        return intervals
-    return np.convolve(intervals, np.ones(window_size)/window_size, mode='valid')
+def analyze_beats_and_meter(audio, use_cache=True):
+    rhythm = get_rhythm(audio, AnalysisCache(enabled=use_cache))
 
-def determine_meter(beat_times, estimated_bpm):
-    if len(beat_times) < 2:
-        return "Unknown"
-
-    measure_duration = 60 / estimated_bpm
-
-    durations = np.diff(beat_times)
-    mean_duration = np.mean(durations)
-
-    tolerance = 0.05
-
-    if abs(mean_duration - measure_duration) < tolerance:
-        return "4/4"
-    elif abs(mean_duration - measure_duration * (3 / 4)) < tolerance:
-        return "3/4"
-    elif abs(mean_duration - measure_duration * (3 / 3)) < tolerance:
-        return "3/3"
-    else:
-        return "Unknown"
-
-def analyze_beats_and_meter(audio_file):
-    y, sr = librosa.load(audio_file, sr=22050 * 2)
-
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-
-    beat_intervals = np.diff(beat_times)
-
-    smoothed_intervals = smooth_intervals(beat_intervals)
-
-    tempo_value = tempo[0] if isinstance(tempo, np.ndarray) else tempo
-    bpm_real = tempo_value
+    bpm_real = rhythm.tempo
     bpm_fixed = round(bpm_real)
+    measure_times = rhythm.bar_times.tolist()
 
-    meter = determine_meter(beat_times, bpm_real)
-
-    total_duration = librosa.get_duration(y=y, sr=sr)
-    measures = round(total_duration * bpm_fixed / 60)
-
-    if bpm_fixed > 0 and measures > 0:
-        measure_duration = 60 / bpm_fixed
-        measure_times = [i * measure_duration for i in range(measures)]
-    else:
-        measure_times = []
-
-    return bpm_real, bpm_fixed, measures, meter, measure_times
+    return bpm_real, bpm_fixed, len(measure_times), rhythm.meter, measure_times
 
 def main():
     audio_file = input("MP3 PATH?: ")
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+
+CACHE_DIR = os.environ.get("CHORDYZER_CACHE_DIR", ".chordyzer_cache")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# eviction frees a little more than needed, so a full cache is not walked again on the very next write
+EVICT_TO = 0.9
+
+# bytes in each cache directory as this process counts them: walked once, then kept up to date by writes
+_cache_sizes = {}
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AnalysisCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def key(self, audio_digest, stage, params):
+        payload = json.dumps({"audio": audio_digest, "stage": stage, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def has(self, key):
+        return self.enabled and os.path.exists(self._path(key))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            # reads refresh the mtime so eviction drops the least recently used entries
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        total = self.size()
+        try:
+            total -= os.path.getsize(path)
+        except OSError:
+            pass
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        total += os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        _cache_sizes[os.path.abspath(self.cache_dir)] = total
+        if total > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        cache_dir = os.path.abspath(self.cache_dir)
+        if cache_dir not in _cache_sizes:
+            _cache_sizes[cache_dir] = sum(size for mtime, size, path in self._entries())
+        return _cache_sizes[cache_dir]
+
+    def get_or_compute(self, audio_digest, stage, params, compute, encode=None, decode=None):
+        key = self.key(audio_digest, stage, params) if self.enabled else None
+        cached = self.get(key) if key else None
+        if cached is not None:
+            return decode(cached) if decode else cached
+        value = compute()
+        if key:
+            self.put(key, encode(value) if encode else value)
+        return value
+
+    def evict(self):
+        # other processes may have written or evicted since, so the walk also corrects the running total
+        entries = list(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        if total > self.max_bytes:
+            for mtime, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+        _cache_sizes[os.path.abspath(self.cache_dir)] = total
@@ -1,12 +1,13 @@
 import os
-import json
-from viewer import generate_html_with_chords
-from db import generate_db_html
-from music import extract_chords_from_audio, get_bpm, get_tone_at_beats, load_scales, match_chords_to_scales
-from download_youtube_audio import download_audio_from_youtube
+from audio import AudioContext
+from cache import AnalysisCache
+from store import open_store
+from chords import encode_chord_events, summarize_chord_events, upgrade_entry
+import argparse
 import re
 
-DB_FILE = "chords_db.json"
+# librosa, chord_extractor and yt_dlp take seconds to import, so the analysis and
+# download stages import them when they run rather than at startup
 
 def sanitize_filename(input_str):
     import unicodedata
@@ -26,60 +27,165 @@ def convert_ndarray_to_list(obj):
     else:
         return obj
 
-def update_chords_db(artist, title, chords, bpm, tempo_changes, tones_at_beats, matches):
-    if os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, "r", encoding="utf-8") as f:
-                chords_db = json.load(f)
-        except json.JSONDecodeError:
-            print("Error: Corrupted JSON...creating new json file")
-            chords_db = []
-    else:
-        chords_db = []
-
-    chord_counts = {}
-    for chord in chords:
-        chord_name = str(chord)
-        chord_counts[chord_name] = chord_counts.get(chord_name, 0) + 1
+def build_song_entry(artist, title, chords, bpm, tempo_changes, tones_at_beats, matches, song_id=None,
+                     duration=None, meter=None, downbeat=None, beat_times=None):
+    chord_events = encode_chord_events(chords)
+    chord_counts, chord_durations = summarize_chord_events(chord_events, duration)
 
     tempo_changes = convert_ndarray_to_list(tempo_changes)
     tones_at_beats_serializable = convert_ndarray_to_list(tones_at_beats)
 
-    song_entry = {
+    return {
+        "id": song_id,
         "artist": artist,
         "title": title,
         "chords": chord_counts,
+        "chord_durations": chord_durations,
+        "chord_events": chord_events,
         "bpm": bpm,
         "tempo_changes": tempo_changes,
         "tones_at_beats": tones_at_beats_serializable,
+        "beat_times": convert_ndarray_to_list(beat_times) if beat_times is not None else None,
+        "meter": meter,
+        "downbeat": downbeat,
         "keynote": matches
     }
 
-    chords_db.append(song_entry)
+def save_song_entry(song_entry, store=None):
+    return (store or open_store()).append(song_entry)
 
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(chords_db, f, indent=4, ensure_ascii=False)
-
-    return song_entry
+def update_chords_db(artist, title, chords, bpm, tempo_changes, tones_at_beats, matches):
+    song_entry = build_song_entry(artist, title, chords, bpm, tempo_changes, tones_at_beats, matches)
+    return save_song_entry(upgrade_entry(song_entry))
 
 def is_youtube_url(url):
     youtube_regex = (
-        r'(https?://)?(www\.)?(youtube\.com/watch\?v=|youtu\.be/)[\w-]+'
+        r'(https?://)?(www\.|m\.|music\.)?(youtube\.com/(watch\?v=|playlist\?list=|shorts/|@)|youtu\.be/)[\w-]+'
     )
     return re.match(youtube_regex, url) is not None
 
-def main():
+def _encode_chords(chords):
+    return [[chord.chord, chord.timestamp] for chord in chords]
+
+def _decode_chords(cached):
+    from chord_extractor import ChordChange
+    return [ChordChange(chord=chord, timestamp=timestamp) for chord, timestamp in cached]
+
+def _encode_stream(result):
+    from rhythm import encode_rhythm
+    rhythm, tones_at_beats, chords = result
+    return {"rhythm": encode_rhythm(rhythm), "tones": convert_ndarray_to_list(tones_at_beats),
+            "chords": _encode_chords(chords)}
+
+def _decode_stream(cached):
+    from rhythm import decode_rhythm
+    tones_at_beats = [tuple(tone) for tone in cached["tones"]]
+    return decode_rhythm(cached["rhythm"]), tones_at_beats, _decode_chords(cached["chords"])
+
+def analyze_song_stream(audio_file, use_cache=True):
+    from music import CHORDINO_PARAMS, PITCH_PARAMS
+    from rhythm import RHYTHM_PARAMS
+    from streaming import analyze_stream, WINDOW_SECONDS, OVERLAP_SECONDS
+    audio = AudioContext(audio_file)
+    params = dict({"sr": audio.sr, "window": WINDOW_SECONDS, "overlap": OVERLAP_SECONDS},
+                  **RHYTHM_PARAMS, **PITCH_PARAMS, **CHORDINO_PARAMS)
+    result = AnalysisCache(enabled=use_cache).get_or_compute(audio.digest, "stream", params,
+                                                             lambda: analyze_stream(audio_file),
+                                                             encode=_encode_stream, decode=_decode_stream)
+    return audio.digest, result
+
+def stage_params(audio):
+    from music import CHORDINO_PARAMS, CHORDINO_SR, PITCH_PARAMS
+    from rhythm import RHYTHM_PARAMS
+    return {
+        "rhythm": dict({"sr": audio.sr}, **RHYTHM_PARAMS),
+        "tones": dict({"sr": audio.sr}, **RHYTHM_PARAMS, **PITCH_PARAMS),
+        "chords": dict({"sr": CHORDINO_SR}, **CHORDINO_PARAMS),
+    }
+
+def is_analysis_cached(audio, cache):
+    return all(cache.has(cache.key(audio.digest, stage, params)) for stage, params in stage_params(audio).items())
+
+def analyze_rhythm_stage(audio, cache):
+    from music import get_tone_at_beats
+    from rhythm import get_rhythm
+    rhythm = get_rhythm(audio, cache)
+    tones_at_beats = cache.get_or_compute(audio.digest, "tones", stage_params(audio)["tones"],
+                                          lambda: get_tone_at_beats(audio, rhythm.beat_times),
+                                          encode=convert_ndarray_to_list,
+                                          decode=lambda cached: [tuple(tone) for tone in cached])
+    return rhythm, tones_at_beats
+
+def analyze_chord_stage(audio, cache):
+    from music import extract_chords_from_audio
+    return cache.get_or_compute(audio.digest, "chords", stage_params(audio)["chords"],
+                                lambda: extract_chords_from_audio(audio),
+                                encode=_encode_chords, decode=_decode_chords)
+
+def analyze_song(audio_file, artist_name, song_title, verbose=True, use_cache=True, stream=False):
+    if stream:
+        digest, (rhythm, tones_at_beats, chords) = analyze_song_stream(audio_file, use_cache)
+        return finish_song(audio_file, artist_name, song_title, digest, rhythm, tones_at_beats, chords, verbose)
+
+    audio = AudioContext(audio_file)
+    cache = AnalysisCache(enabled=use_cache)
+    rhythm, tones_at_beats = analyze_rhythm_stage(audio, cache)
+    chords = analyze_chord_stage(audio, cache)
+    audio.release()
+    return finish_song(audio_file, artist_name, song_title, audio.digest, rhythm, tones_at_beats, chords, verbose)
+
+def finish_song(audio_file, artist_name, song_title, digest, rhythm, tones_at_beats, chords, verbose):
+    from music import load_scales, match_chords_to_scales
+    from viewer import generate_html_with_chords
+    if verbose:
+        print(f"BPM: {rhythm.tempo}")
+        print(f"Meter: {rhythm.meter}, {len(rhythm.bar_times)} bars")
+        for start, end, bpm in rhythm.tempo_map:
+            print(f"Tempo: {start:.2f}s - {end:.2f}s at {bpm} BPM")
+        print(f"Beat times: {rhythm.beat_times}")
+        print("Tones at detected beats:")
+        for beat_time, tone in tones_at_beats:
+            print(f"Time: {beat_time:.2f}s - Tone: {tone}")
+
+    keynote, matched_scales = match_chords_to_scales(chords, load_scales())
+    if verbose:
+        print(f"Keynote: {keynote}")
+
+    song_entry = build_song_entry(artist_name, song_title, chords, rhythm.tempo, rhythm.tempo_map, tones_at_beats,
+                                  matched_scales, song_id=digest[:16], duration=rhythm.duration, meter=rhythm.meter,
+                                  downbeat=rhythm.downbeat, beat_times=rhythm.beat_times)
+
+    html_file = generate_html_with_chords(audio_file, chords, artist_name, song_title, rhythm.tempo, rhythm.beat_times,
+                                          tones_at_beats, keynote, bar_times=rhythm.bar_times)
+    return song_entry, html_file
+
+def run(args):
+    if args.report_only:
+        from db import rebuild_report
+        rebuild_report(open_store(args.db))
+        return
+
     input_path = input("Enter the path to the audio file or YouTube URL: ")
 
     if is_youtube_url(input_path):
-        artist_name = input("Enter the artist name: ")
-        song_title = input("Enter the song title: ")
+        from download_youtube_audio import download_audio, youtube_video_id
+        if youtube_video_id(input_path) is None:
+            # a playlist or channel: every song is named from its YouTube info
+            output_dir = input("Enter the directory where the audio files should be saved: ")
+            from pipeline import YoutubeFetcher, collect_sources, run_pipeline
+            run_pipeline(collect_sources([input_path]), fetcher=YoutubeFetcher(output_dir),
+                         use_cache=not args.no_cache, db=args.db)
+            return
+
+        artist_name = input("Enter the artist name (blank: from YouTube): ")
+        song_title = input("Enter the song title (blank: from YouTube): ")
         output_dir = input("Enter the directory where the audio file should be saved: ")
 
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        audio_file = download_audio_from_youtube(input_path, artist_name, song_title, output_dir)
+        song = download_audio(input_path, output_dir, artist_name, song_title)
+        audio_file, artist_name, song_title = song["path"], song["artist"], song["title"]
     else:
         audio_file = input_path
         artist_name = input("Enter the artist name: ")
@@ -89,27 +195,38 @@ def main():
             print("Error: File does not exist.")
             return
 
-    tempo, beat_times = get_bpm(audio_file)
-    print(f"BPM: {tempo}")
-    print(f"Beat times: {beat_times}")
-
-    tones_at_beats = get_tone_at_beats(audio_file, beat_times)
-
-    print("Tones at detected beats:")
-    for beat_time, tone in tones_at_beats:
-        print(f"Time: {beat_time:.2f}s - Tone: {tone}")
-
-    chords = extract_chords_from_audio(audio_file)
-
-    keynote, matched_scales = match_chords_to_scales(chords, load_scales())
-    print(f"Keynote: {keynote}")
-
-    song_entry = update_chords_db(artist_name, song_title, chords, tempo, beat_times, tones_at_beats, matched_scales)
-
-    html_file = generate_html_with_chords(audio_file, chords, artist_name, song_title, tempo, beat_times, tones_at_beats, keynote)
+    song_entry, html_file = analyze_song(audio_file, artist_name, song_title, use_cache=not args.no_cache,
+                                        stream=args.stream)
+    store = open_store(args.db)
+    save_song_entry(song_entry, store)
     print(f"Analysis complete. Results saved to {html_file}")
 
-    generate_db_html()
+    from db import add_song_to_report
+    add_song_to_report(song_entry, store)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Extract chords, tempo and key from a song.")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every analysis stage, ignoring the cache")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Analyze the audio in overlapping windows to keep memory flat on very long recordings")
+    parser.add_argument("--report-only", action="store_true",
+                        help="Only regenerate chords_database.html from the database, without analyzing a song")
+    parser.add_argument("--import-time", action="store_true",
+                        help="Print how long each module took to import, like python -X importtime")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.import_time:
+        return run(args)
+
+    import importtime
+    importtime.enable()
+    try:
+        return run(args)
+    finally:
+        importtime.report()
 
 if __name__ == "__main__":
     main()
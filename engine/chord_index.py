@@ -0,0 +1,244 @@
+import re
+import numpy as np
+from chords import CHORD_FAMILIES, NOTE_NAMES, canonical_quality, chord_family, chord_sequence, parse_chord
+from sidecar import PersistedIndex
+from store import iter_latest_songs, open_store
+
+INDEX_FILE = "chords_index.npz"
+MAX_NGRAM = 3
+# a chord after the first is stored as one token: the interval from the previous root and the chord family
+TOKEN_BASE = 12 * len(CHORD_FAMILIES)
+
+_ROMAN = re.compile(r"^([b#♭♯]?)(VII|VI|V|IV|III|II|I|vii|vi|v|iv|iii|ii|i)(.*)$")
+_DEGREES = {"i": 0, "ii": 2, "iii": 4, "iv": 5, "v": 7, "vi": 9, "vii": 11}
+_FAMILY_IDS = {family: i for i, family in enumerate(CHORD_FAMILIES)}
+
+def _ngram_keys(families, tokens, n):
+    # keys of every n-gram starting at each position; the length goes in the lowest bits
+    # so grams of different sizes never share a key
+    keys = families[:len(families) - n + 1].astype(np.int64)
+    for offset in range(1, n):
+        keys = keys * TOKEN_BASE + tokens[offset:len(tokens) - n + 1 + offset]
+    return keys * (MAX_NGRAM + 1) + n
+
+def _tokens(roots, families):
+    intervals = (roots.astype(np.int64) - np.roll(roots, 1)) % 12
+    return intervals * len(CHORD_FAMILIES) + families
+
+class ChordIndex(PersistedIndex):
+    """Inverted index of chord n-grams, normalized so a progression matches in every key."""
+
+    ARRAY_NAMES = ("song_ids", "artists", "titles", "qualities", "offsets", "roots", "families", "quality_ids",
+                   "timestamps", "keys", "positions")
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self._songs = np.repeat(np.arange(len(self.song_ids)), np.diff(self.offsets))
+        self._quality_lookup = {quality: i for i, quality in enumerate(self.qualities)}
+
+    @classmethod
+    def build(cls, store=None):
+        store = store or open_store()
+        song_ids, artists, titles = [], [], []
+        qualities = {}
+        # the same few dozen chord names come back in every song, each is parsed once
+        chord_tokens = {}
+        lengths, roots, families, quality_ids, timestamps = [], [], [], [], []
+        for entry in iter_latest_songs(store, full=True):
+            length = 0
+            for name, timestamp in chord_sequence(entry.get("chord_events")):
+                if name not in chord_tokens:
+                    parsed = parse_chord(name)
+                    if parsed is not None:
+                        quality = canonical_quality(parsed[1])
+                        parsed = (parsed[0], _FAMILY_IDS[chord_family(quality)],
+                                  qualities.setdefault(quality, len(qualities)))
+                    chord_tokens[name] = parsed
+                token = chord_tokens[name]
+                if token is None:
+                    continue
+                roots.append(token[0])
+                families.append(token[1])
+                quality_ids.append(token[2])
+                timestamps.append(timestamp)
+                length += 1
+            if not length:
+                continue
+            song_ids.append(entry.get("id") or "")
+            artists.append(entry.get("artist", "Unknown"))
+            titles.append(entry.get("title", "Unknown"))
+            lengths.append(length)
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        roots = np.asarray(roots, dtype=np.uint8)
+        families = np.asarray(families, dtype=np.uint8)
+        songs = np.repeat(np.arange(len(lengths)), lengths)
+        tokens = _tokens(roots, families)
+
+        all_keys, all_positions = [], []
+        for n in range(1, MAX_NGRAM + 1):
+            starts = np.arange(max(len(roots) - n + 1, 0))
+            # an n-gram may not run from the end of one song into the next
+            inside = songs[starts] == songs[starts + n - 1]
+            all_keys.append(_ngram_keys(families, tokens, n)[inside])
+            all_positions.append(starts[inside])
+        keys = np.concatenate(all_keys)
+        positions = np.concatenate(all_positions)
+        order = np.argsort(keys, kind="stable")
+
+        return cls({
+            "song_ids": np.asarray(song_ids, dtype=str),
+            "artists": np.asarray(artists, dtype=str),
+            "titles": np.asarray(titles, dtype=str),
+            "qualities": np.asarray(list(qualities), dtype=str),
+            "offsets": offsets,
+            "roots": roots,
+            "families": families,
+            "quality_ids": np.asarray(quality_ids, dtype=np.uint16),
+            "timestamps": np.asarray(timestamps, dtype=np.float32),
+            "keys": keys[order],
+            "positions": positions[order].astype(np.int32),
+            "db_updated_at": np.float64(store.updated_at() or 0.0),
+        })
+
+    def postings(self, key):
+        start, end = np.searchsorted(self.keys, [key, key + 1])
+        return self.positions[start:end]
+
+    def find(self, query, transposed=False, loose=False):
+        """Positions in the index where the query progression starts, in song order.
+
+        query is a parsed progression (see parse_query). Chords given by name match in their
+        own key unless transposed is set; roman numerals match in any key. With loose, a
+        chord matches any chord of its family, e.g. Dm matches Dm7.
+        """
+        if not query:
+            return np.zeros(0, dtype=np.int64)
+        roots = np.asarray([root for root, quality, relative in query], dtype=np.uint8)
+        families = np.asarray([_FAMILY_IDS[chord_family(quality)] for root, quality, relative in query],
+                              dtype=np.uint8)
+        intervals = (roots.astype(np.int64) - np.roll(roots, 1)) % 12
+        tokens = intervals * len(CHORD_FAMILIES) + families
+        transposed = transposed or query[0][2]
+
+        # the rarest n-gram of the query gives the fewest candidates to check
+        n = min(MAX_NGRAM, len(query))
+        keys = _ngram_keys(families, tokens, n)
+        candidates = None
+        for offset, key in enumerate(keys):
+            found = self.postings(key) - offset
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+        candidates = candidates[(candidates >= 0) & (candidates + len(query) <= len(self.roots))]
+
+        songs = self._songs[candidates]
+        match = songs == self._songs[candidates + len(query) - 1]
+        for i, (root, quality, relative) in enumerate(query):
+            at = candidates + i
+            match &= self.families[at] == families[i]
+            if i:
+                match &= (self.roots[at].astype(np.int64) - self.roots[at - 1]) % 12 == intervals[i]
+            if not loose:
+                match &= self.quality_ids[at] == self._quality_lookup.get(quality, -1)
+        if not transposed:
+            match &= self.roots[candidates] == roots[0]
+        return np.sort(candidates[match])
+
+    def search(self, query, transposed=False, loose=False, limit=100):
+        """The first matches of find() as dicts with the song, the chords and their times."""
+        return self.describe(self.find(query, transposed, loose)[:limit], len(query))
+
+    def describe(self, starts, length):
+        results = []
+        for start in starts:
+            song = self._songs[start]
+            end = start + length
+            results.append({
+                "id": str(self.song_ids[song]),
+                "artist": str(self.artists[song]),
+                "title": str(self.titles[song]),
+                "start": round(float(self.timestamps[start]), 3),
+                "end": round(float(self.timestamps[end]), 3) if end < self.offsets[song + 1] else None,
+                "chords": [self.chord_name(position) for position in range(start, end)],
+            })
+        return results
+
+    def chord_name(self, position):
+        quality = str(self.qualities[self.quality_ids[position]])
+        return NOTE_NAMES[self.roots[position]] + quality
+
+def parse_roman(numeral):
+    match = _ROMAN.match(numeral)
+    if not match:
+        return None
+    accidental, degree, suffix = match.groups()
+    root = (_DEGREES[degree.lower()] + {"": 0, "b": -1, "♭": -1, "#": 1, "♯": 1}[accidental]) % 12
+    if suffix.startswith(("°", "o")):
+        quality = "dim" + suffix[1:]
+    elif suffix.startswith("ø"):
+        quality = "m7b5"
+    elif suffix.startswith("+"):
+        quality = "aug" + suffix[1:]
+    else:
+        quality = ("" if degree.isupper() else "m") + suffix
+    return root, canonical_quality(quality)
+
+def parse_query(text):
+    """A progression such as "Am F C G" or "ii V I" as (root, quality, relative) per chord."""
+    query = []
+    for chord in re.split(r"[\s,\-–—]+", text.strip()):
+        if not chord:
+            continue
+        parsed = parse_chord(chord)
+        if parsed is not None:
+            query.append((parsed[0], canonical_quality(parsed[1]), False))
+            continue
+        parsed = parse_roman(chord)
+        if parsed is None:
+            raise ValueError(f"not a chord or roman numeral: {chord}")
+        query.append((parsed[0], parsed[1], True))
+    if len({relative for root, quality, relative in query}) > 1:
+        raise ValueError("a progression is written either in chord names or in roman numerals, not both")
+    return query
+
+def open_index(path=INDEX_FILE, store=None, rebuild=False):
+    return ChordIndex.open(path, store or open_store(), rebuild)
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Find the songs that play a chord progression.")
+    parser.add_argument("progression", nargs="?", default=None,
+                        help='Chord names ("Am F C G") or roman numerals in any key ("ii V I")')
+    parser.add_argument("--transposed", action="store_true", help="Match chord names in any key")
+    parser.add_argument("--loose", action="store_true",
+                        help="Match chords by family only (major, minor...), so Dm also finds Dm7")
+    parser.add_argument("--limit", type=int, default=50, help="Most matches to print")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"Index file (default: {INDEX_FILE})")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    index = open_index(args.index, open_store(args.db), rebuild=args.rebuild)
+    if args.progression is None:
+        print(f"Index of {len(index.song_ids)} songs and {len(index.roots)} chord changes: {args.index}")
+        return
+    try:
+        query = parse_query(args.progression)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    starts = index.find(query, transposed=args.transposed, loose=args.loose)
+    elapsed = time.perf_counter() - started
+    for result in index.describe(starts[:args.limit], len(query)):
+        end = f"{result['end']:.2f}" if result["end"] is not None else "end"
+        print(f"{result['artist']} - {result['title']} [{result['id']}] "
+              f"{result['start']:.2f}-{end}s: {' '.join(result['chords'])}")
+    shown = f", first {args.limit} shown" if len(starts) > args.limit else ""
+    print(f"{len(starts)} matches in {elapsed * 1000:.1f} ms{shown}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import re
+from collections import namedtuple
+
+ChordEvent = namedtuple("ChordEvent", ["chord", "timestamp"])
+
+_CHORD_REPR = re.compile(r"chord='(.+?)', timestamp=(\d+(?:\.\d+)?(?:e-?\d+)?)")
+_CHORD_NAME = re.compile(r"^([A-G])([#b\u266f\u266d]*)([^/]*)(?:/(.+))?$")
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+_LETTER_PITCH_CLASSES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_ACCIDENTALS = {"#": 1, "\u266f": 1, "b": -1, "\u266d": -1}
+
+QUALITY_INTERVALS = {
+    "": (0, 4, 7),
+    "maj": (0, 4, 7),
+    "m": (0, 3, 7),
+    "min": (0, 3, 7),
+    "dim": (0, 3, 6),
+    "aug": (0, 4, 8),
+    "sus": (0, 5, 7),
+    "sus4": (0, 5, 7),
+    "sus2": (0, 2, 7),
+    "5": (0, 7),
+    "6": (0, 4, 7, 9),
+    "m6": (0, 3, 7, 9),
+    "7": (0, 4, 7, 10),
+    "maj7": (0, 4, 7, 11),
+    "m7": (0, 3, 7, 10),
+    "mmaj7": (0, 3, 7, 11),
+    "m7b5": (0, 3, 6, 10),
+    "dim7": (0, 3, 6, 9),
+    "aug7": (0, 4, 8, 10),
+    "7sus4": (0, 5, 7, 10),
+    "9": (0, 2, 4, 7, 10),
+    "maj9": (0, 2, 4, 7, 11),
+    "m9": (0, 2, 3, 7, 10),
+    "add9": (0, 2, 4, 7),
+}
+
+def note_to_pitch_class(note):
+    match = _CHORD_NAME.match(note.strip())
+    if not match or match.group(3) or match.group(4):
+        return None
+    return (_LETTER_PITCH_CLASSES[match.group(1)] + sum(_ACCIDENTALS[a] for a in match.group(2))) % 12
+
+def parse_chord(name):
+    match = _CHORD_NAME.match(name.strip()) if name else None
+    if not match:
+        return None
+    root = (_LETTER_PITCH_CLASSES[match.group(1)] + sum(_ACCIDENTALS[a] for a in match.group(2))) % 12
+    bass = note_to_pitch_class(match.group(4)) if match.group(4) else None
+    return root, match.group(3), bass
+
+CHORD_FAMILIES = ("maj", "m", "dim", "aug", "sus", "5")
+
+def quality_intervals(quality):
+    intervals = QUALITY_INTERVALS.get(quality)
+    if intervals is None:
+        # unknown extensions still tell us whether the third is minor
+        minor = quality.startswith("m") and not quality.startswith("maj")
+        intervals = QUALITY_INTERVALS["m" if minor else ""]
+    return intervals
+
+def canonical_quality(quality):
+    # spellings of the same chord ("" and "maj", "m" and "min"...) share one name
+    intervals = QUALITY_INTERVALS.get(quality)
+    if intervals is None:
+        return quality
+    return next(name for name, other in QUALITY_INTERVALS.items() if other == intervals)
+
+def chord_family(quality):
+    intervals = set(quality_intervals(quality))
+    if 4 in intervals:
+        return "aug" if 8 in intervals and 7 not in intervals else "maj"
+    if 3 in intervals:
+        return "dim" if 6 in intervals and 7 not in intervals else "m"
+    return "sus" if intervals & {2, 5} else "5"
+
+def chord_pitch_classes(name):
+    parsed = parse_chord(name)
+    if parsed is None:
+        return frozenset()
+    root, quality, bass = parsed
+    return frozenset((root + interval) % 12 for interval in quality_intervals(quality))
+
+def pitch_class_mask(pitch_classes):
+    mask = 0
+    for pitch_class in pitch_classes:
+        mask |= 1 << pitch_class
+    return mask
+
+def encode_chord_events(chords):
+    names, ids, timestamps = [], [], []
+    name_ids = {}
+    for chord in chords:
+        name = getattr(chord, "chord", None) or "N"
+        if name not in name_ids:
+            name_ids[name] = len(names)
+            names.append(name)
+        ids.append(name_ids[name])
+        timestamps.append(round(float(getattr(chord, "timestamp", 0.0)), 3))
+    return {"names": names, "ids": ids, "timestamps": timestamps}
+
+def summarize_chord_events(chord_events, duration=None):
+    names = chord_events["names"]
+    ids = chord_events["ids"]
+    timestamps = chord_events["timestamps"]
+    counts = [0] * len(names)
+    durations = [0.0] * len(names)
+    for i, chord_id in enumerate(ids):
+        counts[chord_id] += 1
+        if i + 1 < len(timestamps):
+            end = timestamps[i + 1]
+        else:
+            end = duration if duration is not None else timestamps[i]
+        durations[chord_id] += max(end - timestamps[i], 0.0)
+    return (dict(zip(names, counts)),
+            {name: round(total, 3) for name, total in zip(names, durations)})
+
+def iter_chord_events(chord_events):
+    names = chord_events["names"]
+    for chord_id, timestamp in zip(chord_events["ids"], chord_events["timestamps"]):
+        yield names[chord_id], timestamp
+
+def chord_sequence(chord_events):
+    """The chord changes of a song as (name, timestamp), without "N" and repeats."""
+    sequence = []
+    if not chord_events:
+        return sequence
+    for name, timestamp in iter_chord_events(chord_events):
+        # "N" (no chord) is not a harmony of its own, the chords either side of it are joined
+        if name != "N" and (not sequence or sequence[-1][0] != name):
+            sequence.append((name, timestamp))
+    return sequence
+
+def upgrade_entry(entry):
+    # entries with an arrays sidecar keep their chord events there
+    if "chord_events" not in entry and "arrays" not in entry:
+        entry = _upgrade_chords(entry)
+    tempo_changes = entry.get("tempo_changes")
+    if tempo_changes and not isinstance(tempo_changes[0], (list, tuple)):
+        # entries written before tempo maps stored every beat time under tempo_changes
+        from tempo import tempo_segments
+        entry = dict(entry, tempo_changes=tempo_segments(tempo_changes))
+    return entry
+
+def _upgrade_chords(entry):
+    chords = entry.get("chords") or {}
+    if isinstance(chords, list):
+        chords = {}
+        for chord in entry["chords"]:
+            name = chord.get("chord", "N/A") if isinstance(chord, dict) else "N/A"
+            chords[name] = chords.get(name, 0) + 1
+    events = []
+    counts = {}
+    for key, count in chords.items():
+        # entries written before chord events were stored keyed their counts by
+        # the repr of each ChordChange, e.g. "ChordChange(chord='Am', timestamp=1.2)"
+        match = _CHORD_REPR.search(key)
+        if match:
+            events.append((float(match.group(2)), match.group(1)))
+            counts[match.group(1)] = counts.get(match.group(1), 0) + count
+        else:
+            counts[key] = counts.get(key, 0) + count
+
+    upgraded = dict(entry)
+    if len(events) == sum(counts.values()):
+        events.sort()
+        chord_events = encode_chord_events(ChordEvent(name, timestamp) for timestamp, name in events)
+        upgraded["chords"], upgraded["chord_durations"] = summarize_chord_events(chord_events)
+        upgraded["chord_events"] = chord_events
+    else:
+        upgraded["chords"] = counts
+        upgraded["chord_durations"] = {}
+        upgraded["chord_events"] = {"names": [], "ids": [], "timestamps": []}
+    return upgraded
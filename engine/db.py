@@ -1,23 +1,12 @@
 import json
 import os
-import re
-from collections import defaultdict
 from datetime import datetime
+from store import atomic_write, iter_latest_songs, open_store
+from stats import StatsUpdater, best_keynote, rebuild_stats, song_key
 
-DB_FILE = "chords_db.json"
+DB_HTML_FILE = "chords_database.html"
 
-def generate_db_html():
-    if os.path.exists(DB_FILE):
-        created_at = datetime.fromtimestamp(os.path.getctime(DB_FILE)).strftime("%Y-%m-%d %H:%M:%S")
-        updated_at = datetime.fromtimestamp(os.path.getmtime(DB_FILE)).strftime("%Y-%m-%d %H:%M:%S")
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            chords_db = json.load(f)
-    else:
-        created_at = "Unknown"
-        updated_at = "Unknown"
-        chords_db = []
-
-    html_content = f"""
+PAGE_HEAD = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -119,6 +108,8 @@ def generate_db_html():
         <button onclick="showBarChart()">Bar Graphs</button>
         <button onclick="showLineChart()">Line Graphs</button>
         <button onclick="showPieChart()">Pie Chart</button>
+        <button onclick="showTransitionChart()">Chord Changes</button>
+        <button onclick="showBpmChart()">BPM</button>
     </div>
     <div id="table-container">
         <table id="chords-table" class="display">
@@ -133,59 +124,32 @@ def generate_db_html():
                 </tr>
             </thead>
             <tbody>
-    """
-
-    chord_counts = defaultdict(int)
-
-    for entry in chords_db:
-        artist = entry.get("artist", "Unknown")
-        title = entry.get("title", "Unknown")
-        bpm = entry.get("bpm", "N/A")
-        keynote = entry.get("keynote", {})
-
-        best_keynote = max(keynote, key=keynote.get, default="Unknown")
-
-        for chord_change in entry.get("chords", {}):
-            if isinstance(chord_change, str):
-                match = re.search(r"chord='(.+?)', timestamp=(\d+\.\d+)", chord_change)
-                if match:
-                    chord = match.group(1)
-                else:
-                    chord = "N/A"
-            elif isinstance(chord_change, dict):
-                chord = chord_change.get("chord", "N/A")
-            else:
-                chord = "N/A"
-
-            if chord == "N":
-                continue
-
-            chord_counts[(artist, title, chord, bpm, best_keynote)] += 1
-
-    for (artist, title, chord, bpm, keynote), count in chord_counts.items():
-        chord_image = f"./engine/diagrams/guitar/{chord}.png"
-        html_content += f"""
-            <tr>
+"""
+
+ROW_TEMPLATE = """
+            <tr data-static>
                 <td>{artist}</td>
                 <td>{title}</td>
                 <td>
                     {chord}
-                    <img src="{chord_image}" alt="Diagram of {chord}" class="chord-image">
+                    <img src="./engine/diagrams/guitar/{chord}.png" alt="Diagram of {chord}" class="chord-image">
                 </td>
                 <td>{count}</td>
                 <td>{bpm}</td>
                 <td>{keynote}</td>
             </tr>
-        """
+"""
 
-    html_content += """
+TABLE_TAIL = """
             </tbody>
         </table>
     </div>
 
     <canvas id="chart-canvas" width="400" height="200" style="display:none;"></canvas>
 
-    <script>
+"""
+
+PAGE_SCRIPT = """    <script>
         var chart;
 
         function destroyChart() {
@@ -199,81 +163,77 @@ def generate_db_html():
             document.getElementById("chart-canvas").style.display = "none";
         }
 
-        function showBarChart() {
+        function drawChart(type, data, title) {
             document.getElementById("table-container").style.display = "none";
             document.getElementById("chart-canvas").style.display = "block";
             destroyChart();
             chart = new Chart(document.getElementById("chart-canvas"), {
-                type: 'bar',
-                data: getDataForChart(),
+                type: type,
+                data: data,
                 options: {
                     responsive: true,
                     plugins: {
                         title: {
                             display: true,
-                            text: 'Bar Graph of Chords Used'
+                            text: title
                         }
                     }
                 }
             });
         }
 
+        function showBarChart() {
+            drawChart('bar', getDataForChart(), 'Bar Graph of Chords Used');
+        }
+
         function showLineChart() {
-            document.getElementById("table-container").style.display = "none";
-            document.getElementById("chart-canvas").style.display = "block";
-            destroyChart();
-            chart = new Chart(document.getElementById("chart-canvas"), {
-                type: 'line',
-                data: getDataForChart(),
-                options: {
-                    responsive: true,
-                    plugins: {
-                        title: {
-                            display: true,
-                            text: 'Line Graph of Chords Used'
-                        }
-                    }
-                }
-            });
+            drawChart('line', getDataForChart(), 'Line Graph of Chords Used');
         }
 
         function showPieChart() {
-            document.getElementById("table-container").style.display = "none";
-            document.getElementById("chart-canvas").style.display = "block";
-            destroyChart();
-            chart = new Chart(document.getElementById("chart-canvas"), {
-                type: 'pie',
-                data: getDataForChart(),
-                options: {
-                    responsive: true,
-                    plugins: {
-                        title: {
-                            display: true,
-                            text: 'Pie Chart of Chords Distribution'
-                        }
-                    }
-                }
-            });
+            drawChart('pie', getDataForChart(), 'Pie Chart of Chords Distribution');
         }
 
-        function getDataForChart() {
-            var labels = [];
-            var data = [];
+        function showTransitionChart() {
+            var pairs = [];
+            if (typeof chordStats !== "undefined") {
+                Object.keys(chordStats.transitions).forEach(function(from) {
+                    var following = chordStats.transitions[from];
+                    Object.keys(following).forEach(function(to) {
+                        pairs.push([from + " \u2192 " + to, following[to]]);
+                    });
+                });
+            }
+            pairs.sort(function(a, b) { return b[1] - a[1]; });
+            pairs = pairs.slice(0, CHART_LIMIT);
+            drawChart('bar', chartData(pairs, 'Times played'), 'Most Common Chord Changes');
+        }
 
-            $('#chords-table tbody tr').each(function() {
-                var artist = $(this).find('td').eq(0).text();
-                var title = $(this).find('td').eq(1).text();
-                var chord = $(this).find('td').eq(2).text();
-                var timesUsed = parseInt($(this).find('td').eq(3).text());
-                labels.push(artist + " - " + title + " (" + chord + ")");
-                data.push(timesUsed);
-            });
+        function showBpmChart() {
+            var bins = [];
+            if (typeof chordStats !== "undefined") {
+                var width = chordStats.bpm.bin_width;
+                Object.keys(chordStats.bpm.counts).forEach(function(start) {
+                    bins.push([Number(start), chordStats.bpm.counts[start]]);
+                });
+                bins.sort(function(a, b) { return a[0] - b[0]; });
+                bins = bins.map(function(bin) { return [bin[0] + "-" + (bin[0] + width), bin[1]]; });
+            }
+            drawChart('bar', chartData(bins, 'Songs'), 'Songs by BPM');
+        }
 
+        function renderChord(chord) {
+            return chord + ' <img src="./engine/diagrams/guitar/' + chord + '.png" alt="Diagram of ' + chord + '" class="chord-image">';
+        }
+
+        var CHART_LIMIT = 40;
+
+        function chartData(pairs, label) {
             return {
-                labels: labels,
+                labels: pairs.map(function(pair) { return pair[0]; }),
                 datasets: [{
-                    label: 'Times Used',
-                    data: data,
+                    label: label,
+                    data: pairs.map(function(pair) { return pair[1]; }),
                     backgroundColor: 'rgba(54, 162, 235, 0.2)',
                     borderColor: 'rgba(54, 162, 235, 1)',
                     borderWidth: 1
@@ -281,8 +241,38 @@ def generate_db_html():
             };
         }
 
+        function getDataForChart() {
+            var pairs = [];
+
+            // the precomputed rollups are used when the page has them, the table is only a fallback
+            if (typeof chordStats !== "undefined") {
+                var chords = chordStats.global.chords;
+                Object.keys(chords).forEach(function(chord) {
+                    pairs.push([chord, chords[chord].count]);
+                });
+                pairs.sort(function(a, b) { return b[1] - a[1]; });
+                return chartData(pairs.slice(0, CHART_LIMIT), 'Times Used');
+            }
+
+            if (typeof chordRows !== "undefined") {
+                chordRows.forEach(function(row) {
+                    pairs.push([row[0] + " - " + row[1] + " (" + row[2] + ")", row[3]]);
+                });
+            }
+
+            $('#chords-table tbody tr[data-static]').each(function() {
+                var artist = $(this).find('td').eq(0).text();
+                var title = $(this).find('td').eq(1).text();
+                var chord = $(this).find('td').eq(2).text();
+                var timesUsed = parseInt($(this).find('td').eq(3).text());
+                pairs.push([artist + " - " + title + " (" + chord + ")", timesUsed]);
+            });
+
+            return chartData(pairs, 'Times Used');
+        }
+
         $(document).ready(function() {
-            $('#chords-table').DataTable({
+            var options = {
                 "paging": true,
                 "lengthChange": true,
                 "searching": true,
@@ -292,16 +282,196 @@ def generate_db_html():
                 "language": {
                     "url": "//cdn.datatables.net/plug-ins/1.10.21/i18n/Spanish.json"
                 }
-            });
+            };
+            if (typeof reportInfo !== "undefined") {
+                $('#report-created-at').text(reportInfo.created_at);
+                $('#report-updated-at').text(reportInfo.updated_at);
+            }
+            if (typeof chordRows !== "undefined") {
+                options.data = chordRows;
+                options.deferRender = true;
+                options.columns = [null, null, {"render": renderChord}, null, null, null];
+            }
+            $('#chords-table').DataTable(options);
         });
     </script>
     </body>
     </html>
-    """
+"""
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return "Unknown"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def song_chord_rows(entry):
+    artist = entry.get("artist", "Unknown")
+    title = entry.get("title", "Unknown")
+    bpm = entry.get("bpm", "N/A")
+    keynote = best_keynote(entry)
+
+    for chord, count in entry.get("chords", {}).items():
+        if chord == "N":
+            continue
+        yield artist, title, chord, count, bpm, keynote
+
+def iter_chord_rows(store):
+    # a re-analyzed song is listed once, with its latest analysis
+    for entry in iter_latest_songs(store):
+        yield from song_chord_rows(entry)
+
+def json_for_script(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+def _stats_script(files):
+    return f'    <script src="./{os.path.basename(files["stats"])}/stats.js"></script>\n'
+
+def iter_db_html(store, data_mode="rows", files=None):
+    yield PAGE_HEAD.format(created_at=_format_time(store.created_at()), updated_at=_format_time(store.updated_at()))
+    if data_mode == "json":
+        yield TABLE_TAIL
+        yield "    <script>var chordRows = ["
+        for i, row in enumerate(iter_chord_rows(store)):
+            yield ("," if i else "") + json_for_script(list(row))
+        yield "];</script>\n"
+    else:
+        for artist, title, chord, count, bpm, keynote in iter_chord_rows(store):
+            yield ROW_TEMPLATE.format(artist=artist, title=title, chord=chord, count=count, bpm=bpm, keynote=keynote)
+        yield TABLE_TAIL
+    if files:
+        yield _stats_script(files)
+    yield PAGE_SCRIPT
+
+def report_files(db_html_file=DB_HTML_FILE):
+    base = os.path.splitext(db_html_file)[0]
+    return {
+        "html": db_html_file,
+        "rows": f"{base}_rows.js",
+        "info": f"{base}_info.js",
+        "state": f"{base}_state.json",
+        "stats": f"{base}_stats",
+    }
+
+REPORT_LAYOUT = "incremental-by-song"
+
+def _rows_script(entry):
+    # one assignment per song: a re-analyzed song is appended again and its latest rows win when the page loads
+    rows = [json_for_script(list(row)) for row in song_chord_rows(entry)]
+    return f"chordSongs[{json_for_script(song_key(entry))}] = [{','.join(rows)}];\n"
+
+def _save_report_state(state, files, store):
+    state["created_at"] = _format_time(store.created_at())
+    state["updated_at"] = _format_time(store.updated_at())
+    state["rows_size"] = os.path.getsize(files["rows"])
+    atomic_write(files["info"], lambda f: f.write(f"var reportInfo = {json_for_script(state)};\n"))
+    atomic_write(files["state"], lambda f: json.dump(state, f, ensure_ascii=False))
+
+def _load_report_state(files, store):
+    try:
+        with open(files["state"], "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if state.get("db") != os.path.abspath(store.path) or not os.path.exists(files["html"]):
+        return None
+    # the html may have been rewritten since in another mode, which does not load the rows file
+    if state.get("layout") != REPORT_LAYOUT:
+        return None
+    if not os.path.exists(files["rows"]) or os.path.getsize(files["rows"]) != state.get("rows_size"):
+        return None
+    return state
+
+def rebuild_report(store=None, db_html_file=DB_HTML_FILE):
+    store = store or open_store()
+    files = report_files(db_html_file)
+    state = {"db": os.path.abspath(store.path), "layout": REPORT_LAYOUT}
+
+    def write_rows(f):
+        for entry in iter_latest_songs(store):
+            f.write(_rows_script(entry))
+
+    def write_shell(f):
+        f.write(PAGE_HEAD.format(created_at='<span id="report-created-at">Unknown</span>',
+                                 updated_at='<span id="report-updated-at">Unknown</span>'))
+        f.write(TABLE_TAIL)
+        f.write("    <script>var chordRows = [], chordSongs = {};</script>\n")
+        f.write(f'    <script src="./{os.path.basename(files["rows"])}"></script>\n')
+        f.write("    <script>Object.keys(chordSongs).forEach(function(song) { "
+                "chordRows.push.apply(chordRows, chordSongs[song]); });</script>\n")
+        f.write(f'    <script src="./{os.path.basename(files["info"])}"></script>\n')
+        f.write(_stats_script(files))
+        f.write(PAGE_SCRIPT)
+
+    atomic_write(files["rows"], write_rows)
+    atomic_write(files["html"], write_shell)
+    _save_report_state(state, files, store)
+    rebuild_stats(files["stats"], store)
+    print(f"HTML file generated: {db_html_file}")
+    return db_html_file
 
-    db_html_file = "chords_database.html"
+class ReportUpdater:
+    """Adds analyzed songs to the report; the statistics are written every few songs and on close()."""
+
+    def __init__(self, store=None, db_html_file=DB_HTML_FILE, flush_every=None):
+        self.store = store or open_store()
+        self.db_html_file = db_html_file
+        self.files = report_files(db_html_file)
+        stats_args = {} if flush_every is None else {"flush_every": flush_every}
+        self.stats = StatsUpdater(self.files["stats"], self.store, **stats_args)
+
+    def add(self, song_entry):
+        state = _load_report_state(self.files, self.store)
+        if state is None:
+            # no usable state from a previous run, so the song is picked up from the db;
+            # that also rewrites the statistics the updater may hold
+            self.stats.discard()
+            return rebuild_report(self.store, self.db_html_file)
+
+        with open(self.files["rows"], "a", encoding="utf-8") as f:
+            f.write(_rows_script(song_entry))
+        _save_report_state(state, self.files, self.store)
+        self.stats.add(song_entry)
+        return self.db_html_file
+
+    def close(self):
+        self.stats.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def add_song_to_report(song_entry, store=None, db_html_file=DB_HTML_FILE):
+    with ReportUpdater(store, db_html_file) as report:
+        return report.add(song_entry)
+
+def generate_db_html(store=None, data_mode="rows", db_html_file=DB_HTML_FILE):
+    store = store or open_store()
+    if data_mode == "incremental":
+        return rebuild_report(store, db_html_file)
+
+    files = report_files(db_html_file)
     with open(db_html_file, "w", encoding="utf-8") as f:
-        f.write(html_content)
+        f.writelines(iter_db_html(store, data_mode, files))
+    # this page has its rows inline, songs added later have to rebuild it rather than append to the rows file
+    if os.path.exists(files["state"]):
+        os.remove(files["state"])
+    rebuild_stats(files["stats"], store)
 
     print(f"HTML file generated: {db_html_file}")
     return db_html_file
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate chords_database.html from the chords database.")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--data-mode", choices=["rows", "json", "incremental"], default="rows",
+                        help="rows: static table markup; json: rows shipped as a JSON payload rendered lazily; "
+                             "incremental: page plus data files that later songs are appended to")
+    args = parser.parse_args()
+    generate_db_html(open_store(args.db), data_mode=args.data_mode)
+
+if __name__ == "__main__":
+    main()
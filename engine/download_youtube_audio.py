@@ -1,35 +1,178 @@
+import argparse
+import json
 import os
-import yt_dlp as youtube_dl
-from pydub import AudioSegment
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+from workers import bounded_map
 
-def download_audio_from_youtube(youtube_url, artist, title, output_dir):
-    artist = artist.replace('/', '_').replace('\\', '_')
-    title = title.replace('/', '_').replace('\\', '_')
+ARCHIVE_FILE = "downloads.jsonl"
+
+def youtube_video_id(url):
+    parsed = urlparse(url if "//" in url else f"https://{url}")
+    if parsed.netloc.endswith("youtu.be"):
+        return parsed.path.strip("/") or None
+    if parsed.path.startswith("/shorts/"):
+        return parsed.path.split("/")[2] or None
+    return (parse_qs(parsed.query).get("v") or [None])[0]
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def song_metadata(info):
+    artist = info.get("artist") or info.get("creator")
+    title = info.get("track")
+    if not (artist and title):
+        name = info.get("title") or info.get("id") or "Unknown"
+        if " - " in name:
+            artist, title = name.split(" - ", 1)
+        else:
+            artist, title = info.get("uploader") or info.get("channel") or "Unknown", name
+    return artist.strip(), title.strip()
+
+class DownloadArchive:
+    """Songs already downloaded to a directory, keyed by video id, so reruns skip them."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._songs = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        song = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._songs[song["video_id"]] = song
+
+    def get(self, video_id):
+        song = self._songs.get(video_id)
+        if song and os.path.exists(song["path"]):
+            return song
+        return None
+
+    def add(self, song):
+        with self._lock:
+            self._songs[song["video_id"]] = song
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(song, ensure_ascii=False) + "\n")
+
+def _is_playlist(entry):
+    # channels list their tabs (videos, shorts, live) as playlists of their own
+    return entry.get("entries") is not None or entry.get("_type") == "playlist" or entry.get("ie_key") == "YoutubeTab"
+
+def _playlist_videos(ydl, info, seen):
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        if _is_playlist(entry):
+            if entry.get("entries") is None:
+                # a flat listing only gives the tab's URL; its videos are listed in turn
+                entry = ydl.extract_info(entry["url"], download=False)
+            yield from _playlist_videos(ydl, entry, seen)
+        elif entry.get("id") and entry.get("ie_key", "Youtube") == "Youtube" and entry["id"] not in seen:
+            # the same video can be listed under more than one tab
+            seen.add(entry["id"])
+            yield entry
+
+def expand_urls(urls):
+    import yt_dlp as youtube_dl
+    for url in urls:
+        video_id = youtube_video_id(url)
+        if video_id:
+            yield {"url": url, "video_id": video_id, "artist": None, "title": None}
+            continue
+        # playlists and channels are listed without resolving every video
+        with youtube_dl.YoutubeDL({"extract_flat": "in_playlist", "quiet": True}) as ydl:
+            info = ydl.extract_info(url, download=False)
+            for entry in _playlist_videos(ydl, info, set()):
+                artist, title = song_metadata(entry)
+                yield {"url": video_url(entry["id"]), "video_id": entry["id"], "artist": artist, "title": title}
+
+def download_audio(url, output_dir, artist=None, title=None, archive=None):
+    video_id = youtube_video_id(url)
+    song = archive.get(video_id) if archive and video_id else None
+    if song:
+        return song
 
-    filename = f"{artist} - {title}.mp3"
-    output_path = os.path.join(output_dir, filename)
+    import yt_dlp as youtube_dl
+    with youtube_dl.YoutubeDL({"format": "bestaudio/best", "noplaylist": True, "quiet": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    info_artist, info_title = song_metadata(info)
+    artist = (artist or info_artist).replace('/', '_').replace('\\', '_')
+    title = (title or info_title).replace('/', '_').replace('\\', '_')
 
+    # a literal % in the name must not be read as an output template field
+    name = f"{artist} - {title}".replace('%', '%%')
+
+    # the stream is saved as it comes (opus, m4a...) under its real extension;
+    # the analysis decodes it directly, so there is nothing to transcode here
     ydl_opts = {
         'format': 'bestaudio/best',
-        'extractaudio': True,
-        'audioformat': 'mp3',
-        'outtmpl': output_path,
+        'outtmpl': os.path.join(output_dir, f"{name}.%(ext)s"),
         'noplaylist': True,
+        'continuedl': True,
+        'quiet': True,
     }
 
+    # the info already extracted is reused, so the video page is only fetched once
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        ydl.extract_info(youtube_url, download=True)
+        result = ydl.process_ie_result(info, download=True)
+        downloads = result.get("requested_downloads") or [{}]
+        output_path = downloads[0].get("filepath") or ydl.prepare_filename(result)
 
-    return output_path
+    song = {"url": url, "video_id": info.get("id") or video_id, "artist": artist, "title": title, "path": output_path}
+    if archive:
+        archive.add(song)
+    return song
 
-if __name__ == "__main__":
-    youtube_url = input("Enter the YouTube URL: ")
-    artist = input("Enter the artist name: ")
-    title = input("Enter the song title: ")
-    output_dir = input("Enter the directory where the audio file should be saved: ")
+def download_audio_from_youtube(youtube_url, artist, title, output_dir):
+    return download_audio(youtube_url, output_dir, artist, title)["path"]
+
+def download_many(urls, output_dir, workers=4, max_pending=None, use_archive=True):
+    os.makedirs(output_dir, exist_ok=True)
+    archive = DownloadArchive(os.path.join(output_dir, ARCHIVE_FILE)) if use_archive else None
+    max_pending = max_pending or workers * 2
+    songs = expand_urls(urls)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(song):
+            return executor.submit(download_audio, song["url"], output_dir, song["artist"], song["title"], archive)
+
+        for song, result, error in bounded_map(submit, songs, max_pending):
+            yield result if error is None else dict(song, error=error)
 
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+def main():
+    parser = argparse.ArgumentParser(description="Download the audio of YouTube videos, playlists or channels.")
+    parser.add_argument("urls", nargs="*", help="Video, playlist or channel URLs; prompts for one video if omitted")
+    parser.add_argument("-o", "--output-dir", default=".", help="Where the audio files are saved")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="Concurrent downloads")
+    parser.add_argument("--no-archive", action="store_true",
+                        help=f"Download again even if {ARCHIVE_FILE} says a video is already there")
+    args = parser.parse_args()
 
-    audio_file_path = download_audio_from_youtube(youtube_url, artist, title, output_dir)
-    print(f"Audio file saved to: {audio_file_path}")
+    if not args.urls:
+        youtube_url = input("Enter the YouTube URL: ")
+        artist = input("Enter the artist name: ")
+        title = input("Enter the song title: ")
+        output_dir = input("Enter the directory where the audio file should be saved: ")
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        audio_file_path = download_audio_from_youtube(youtube_url, artist, title, output_dir)
+        print(f"Audio file saved to: {audio_file_path}")
+        return
+
+    failed = 0
+    for song in download_many(args.urls, args.output_dir, workers=args.workers, use_archive=not args.no_archive):
+        if "error" in song:
+            failed += 1
+            print(f"[failed] {song['url']}: {song['error']}")
+        else:
+            print(f"[ok] {song['artist']} - {song['title']} -> {song['path']}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
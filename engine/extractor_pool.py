@@ -0,0 +1,61 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from workers import bounded_map
+
+_worker_params = None
+
+def init_chordino_worker(chordino_params):
+    global _worker_params
+    from music import get_chordino
+    _worker_params = chordino_params
+    # the plugin is loaded and initialised once here, every file of the worker reuses it
+    get_chordino(_worker_params)
+
+def _extract(audio_file):
+    from music import extract_chords_from_audio
+    return extract_chords_from_audio(audio_file, params=_worker_params)
+
+class ChordinoPool:
+    def __init__(self, workers=None, **chordino_params):
+        from music import CHORDINO_PARAMS
+        self.workers = workers or os.cpu_count() or 1
+        self.chordino_params = dict(CHORDINO_PARAMS, **chordino_params)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_chordino_worker,
+                                             initargs=(self.chordino_params,))
+
+    def submit(self, audio_file):
+        return self._executor.submit(_extract, audio_file)
+
+    def extract(self, audio_file):
+        return self.submit(audio_file).result()
+
+    def extract_many(self, audio_files, max_pending=None):
+        return bounded_map(self.submit, audio_files, max_pending or self.workers * 2)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract chords from many files with a pool of warmed Chordino workers.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--roll-on", type=float, default=None, help="Chordino spectral roll-on (0 - 5)")
+    args = parser.parse_args()
+
+    chordino_params = {} if args.roll_on is None else {"rollon": args.roll_on}
+    with ChordinoPool(workers=args.workers, **chordino_params) as pool:
+        for audio_file, chords, error in pool.extract_many(args.files):
+            if error:
+                print(f"[failed] {audio_file}: {error}")
+            else:
+                print(f"[ok] {audio_file}: {len(chords)} chord changes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import builtins
+import sys
+import time
+
+_records = []
+_stack = []
+_original_import = None
+
+def _timed_import(name, globals=None, *args, **kwargs):
+    if name in sys.modules:
+        return _original_import(name, globals, *args, **kwargs)
+    _stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        # "from . import x" has no name of its own, report it under its package
+        name = name or (globals or {}).get("__package__") or "."
+        _records.append((name, elapsed - children, elapsed, len(_stack)))
+
+def enable():
+    global _original_import
+    if _original_import is None:
+        _original_import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+def disable():
+    global _original_import
+    if _original_import is not None:
+        builtins.__import__ = _original_import
+        _original_import = None
+
+def report(out=None, limit=20):
+    out = out or sys.stderr
+    # same columns as python -X importtime, slowest first
+    top = sorted((record for record in _records if record[3] == 0), key=lambda record: record[2], reverse=True)
+    print("import time: self [us] | cumulative | imported package", file=out)
+    for name, self_time, cumulative, depth in top[:limit]:
+        print(f"import time: {self_time * 1e6:9.0f} | {cumulative * 1e6:10.0f} | {name}", file=out)
+    print(f"import time: total {sum(record[2] for record in top):.3f}s in {len(_records)} modules", file=out)
@@ -1,85 +1,237 @@
+import logging
 import os
 import librosa
 import numpy as np
-from chord_extractor.extractors import Chordino
+import vamp
+from chord_extractor import ChordChange
 from scales import scales
+from audio import as_audio_context
+from rhythm import analyze_rhythm
+from chords import chord_pitch_classes, note_to_pitch_class, parse_chord, pitch_class_mask
 
-def extract_chords_from_audio(audio_file):
-    chordino = Chordino(roll_on=1.0)
-    chords = chordino.extract(audio_file)
-    return chords
-
-def get_bpm(audio_file):
-    y, sr = librosa.load(audio_file)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-    if isinstance(tempo, np.ndarray):
-        tempo = tempo[0] if tempo.size == 1 else tempo
-    return tempo, beat_times
-
-def get_reference_pitch_segment(y, sr, start_time, end_time):
-    segment = y[int(sr * start_time): int(sr * end_time)]
-    pitches, magnitudes = librosa.piptrack(y=segment, sr=sr)
-    magnitude_median = np.median(magnitudes)
-    a4_range = (440.0 * np.power(2, -0.5), 440.0 * np.power(2, 0.5))
-    a4_frequencies = [pitches[i, j] for i in range(pitches.shape[0]) for j in range(pitches.shape[1])
-                      if magnitudes[i, j] > magnitude_median and a4_range[0] <= pitches[i, j] <= a4_range[1]]
-    return np.mean(a4_frequencies) if a4_frequencies else 440.0
-
-def get_tone_from_frequencies(frequencies, reference_freq):
+_log = logging.getLogger(__name__)
+
+CHORDINO_KEY = 'nnls-chroma:chordino'
+# Vamp parameters of Chordino, as chord-extractor's Chordino(roll_on=1.0) passes them
+CHORDINO_PARAMS = {"useNNLS": 1, "rollon": 1.0, "tuningmode": 0, "whitening": 1.0, "s": 0.7, "boostn": 0.1}
+# Chordino.extract() loads files with librosa's default rate, so chords are extracted at that rate
+CHORDINO_SR = 22050
+PITCH_PARAMS = {"n_fft": 2048, "hop_length": 512}
+
+class ChordinoPlugin:
+    """One loaded and initialised Chordino Vamp plugin, reused for every buffer it extracts chords from."""
+
+    def __init__(self, params=None, sr=CHORDINO_SR):
+        self.sr = sr
+        # vamp.collect() loads, initialises and unloads the plugin on every call; here that happens once
+        self.plugin, self.step_size, self.block_size = vamp.load.load_and_configure(
+            np.zeros(1, dtype=np.float32), sr, CHORDINO_KEY, dict(params or CHORDINO_PARAMS))
+        self.output = self.plugin.get_output(0)
+
+    def extract(self, y):
+        frames = vamp.frames.frames_from_array(y, self.step_size, self.block_size)
+        # the plugin is reset before the first block, so nothing is carried over from the previous buffer
+        output = self.output["identifier"]
+        results = vamp.process.process_with_initialised_plugin(frames, self.sr, self.step_size, self.plugin, [output])
+        # the chord output has its own timestamps, vamp.collect() passes its features on as they are
+        return [ChordChange(chord=result[output]['label'], timestamp=float(result[output]['timestamp']))
+                for result in results]
+
+_chordinos = {}
+
+def get_chordino(params=None):
+    """This process's Chordino for the given parameters, loaded on first use."""
+    params = params or CHORDINO_PARAMS
+    key = tuple(sorted(params.items()))
+    if key not in _chordinos:
+        _chordinos[key] = ChordinoPlugin(params)
+    return _chordinos[key]
+
+def extract_chords_from_audio(audio, params=None):
+    y, sr = as_audio_context(audio).load(CHORDINO_SR)
+    return get_chordino(params).extract(y)
+
+def get_bpm(audio):
+    rhythm = analyze_rhythm(audio)
+    return rhythm.tempo, rhythm.beat_times
+
+A4_RANGE = (440.0 * np.power(2, -0.5), 440.0 * np.power(2, 0.5))
+
+def get_tone_from_frequencies(frequencies, reference_freq=440.0):
     if len(frequencies) == 0:
         return None
     tones = librosa.hz_to_midi(frequencies)
     median_tone = np.median(tones)
     return librosa.midi_to_note(median_tone)
 
-def get_tone_at_beats(audio_file, beat_times):
-    y, sr = librosa.load(audio_file)
-    tones_at_beats = []
-    for i, beat_time in enumerate(beat_times[:-1]):
-        start_time = beat_time
-        end_time = beat_times[i + 1]
-        reference_freq = get_reference_pitch_segment(y, sr, start_time, end_time)
-        segment = y[int(sr * start_time): int(sr * end_time)]
-        pitches, magnitudes = librosa.piptrack(y=segment, sr=sr)
-        magnitude_median = np.median(magnitudes)
-        significant_pitches = pitches[magnitudes > magnitude_median]
-        if significant_pitches.size > 0:
-            tone = get_tone_from_frequencies(significant_pitches, reference_freq)
-            tones_at_beats.append((beat_time, tone))
-    return tones_at_beats
+def _expand_ranges(starts, lengths):
+    offsets = np.cumsum(lengths) - lengths
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(owners.size) - offsets[owners] + starts[owners]
+    return owners, positions
+
+def _segment_order_statistic(sorted_values, seg_starts, ranks, zeros_before, n_zeros):
+    # ranks are taken over every cell of the segment, including the implicit zeros
+    # that piptrack leaves outside spectral peaks and that are not stored in sorted_values
+    result = np.zeros(len(ranks), dtype=sorted_values.dtype)
+    below = ranks < zeros_before
+    above = ranks >= zeros_before + n_zeros
+    result[below] = sorted_values[seg_starts[below] + ranks[below]]
+    result[above] = sorted_values[seg_starts[above] + ranks[above] - n_zeros[above]]
+    return result
+
+def _segment_medians(values, segments, n_segments, n_cells=None):
+    counts = np.bincount(segments, minlength=n_segments)
+    if n_cells is None:
+        n_cells = counts
+    order = np.lexsort((values, segments))
+    sorted_values = values[order]
+    seg_starts = np.cumsum(counts) - counts
+    negatives = np.bincount(segments, weights=values < 0, minlength=n_segments).astype(int)
+    n_zeros = n_cells - counts
+    medians = np.full(n_segments, np.nan)
+    valid = n_cells > 0
+    args = (sorted_values, seg_starts[valid])
+    lo = _segment_order_statistic(*args, (n_cells[valid] - 1) // 2, negatives[valid], n_zeros[valid])
+    hi = _segment_order_statistic(*args, n_cells[valid] // 2, negatives[valid], n_zeros[valid])
+    medians[valid] = (lo + hi) / 2
+    return medians
+
+def _segment_spectra(y, starts, stops, n_fft, hop_length, block_frames):
+    # frames every beat segment exactly as a centered, zero padded stft of the
+    # segment alone would, but for all segments at once and in bounded blocks
+    lengths = 1 + (stops - starts) // hop_length
+    segments, local_frames = _expand_ranges(np.zeros_like(starts), lengths)
+    centers = starts[segments] + local_frames * hop_length
+    window = librosa.filters.get_window('hann', n_fft, fftbins=True).astype(y.dtype)
+    offsets = np.arange(n_fft) - n_fft // 2
+    for block in range(0, len(segments), block_frames):
+        block_segments = segments[block:block + block_frames]
+        idx = centers[block:block + block_frames, None] + offsets
+        inside = (idx >= starts[block_segments, None]) & (idx < stops[block_segments, None])
+        frames = np.where(inside, y[np.clip(idx, 0, len(y) - 1)], 0) * window
+        yield block_segments, np.abs(np.fft.rfft(frames, n=n_fft, axis=1)).T
+
+def analyze_pitch_at_beats(audio, beat_times, n_fft=PITCH_PARAMS["n_fft"], hop_length=PITCH_PARAMS["hop_length"],
+                           block_frames=1024):
+    y, sr = as_audio_context(audio).load()
+    beat_times = np.asarray(beat_times)
+    n_segments = max(len(beat_times) - 1, 0)
+    medians = np.full(n_segments, np.nan)
+    references = np.full(n_segments, 440.0)
+    if n_segments == 0:
+        return medians, references
+
+    bounds = np.minimum((sr * beat_times).astype(int), len(y))
+    starts, stops = bounds[:-1], bounds[1:]
+
+    cell_segments, cell_magnitudes, cell_pitches = [], [], []
+    for frame_segments, S in _segment_spectra(y, starts, stops, n_fft, hop_length, block_frames):
+        pitches, magnitudes = librosa.piptrack(S=S, sr=sr, n_fft=n_fft, hop_length=hop_length)
+        peak_frames, peak_bins = np.nonzero(magnitudes.T)
+        cell_segments.append(frame_segments[peak_frames])
+        cell_magnitudes.append(magnitudes[peak_bins, peak_frames])
+        cell_pitches.append(pitches[peak_bins, peak_frames])
+    cell_segments = np.concatenate(cell_segments)
+    cell_magnitudes = np.concatenate(cell_magnitudes)
+    cell_pitches = np.concatenate(cell_pitches)
+
+    n_cells = (1 + (stops - starts) // hop_length) * (1 + n_fft // 2)
+    magnitude_medians = _segment_medians(cell_magnitudes, cell_segments, n_segments, n_cells=n_cells)
+    significant = cell_magnitudes > magnitude_medians[cell_segments]
+    significant_segments = cell_segments[significant]
+    significant_pitches = cell_pitches[significant]
+
+    if significant_segments.size > 0:
+        tones = librosa.hz_to_midi(significant_pitches)
+        medians = _segment_medians(tones, significant_segments, n_segments)
+
+    in_a4 = (significant_pitches >= A4_RANGE[0]) & (significant_pitches <= A4_RANGE[1])
+    a4_counts = np.bincount(significant_segments[in_a4], minlength=n_segments)
+    a4_sums = np.bincount(significant_segments[in_a4], weights=significant_pitches[in_a4], minlength=n_segments)
+    np.divide(a4_sums, a4_counts, out=references, where=a4_counts > 0)
+    return medians, references
+
+def get_tone_at_beats(audio, beat_times):
+    medians, _ = analyze_pitch_at_beats(audio, beat_times)
+    voiced = np.flatnonzero(~np.isnan(medians))
+    if voiced.size == 0:
+        return []
+    notes = librosa.midi_to_note(medians[voiced])
+    return [(beat_times[i], str(note)) for i, note in zip(voiced, notes)]
 
 def simplify_chord(chord_name):
     if '/' in chord_name:
         chord_name = chord_name.split('/')[0]
     return chord_name
 
+class ScaleIndex:
+    def __init__(self, scales):
+        self.source = scales
+        self.keys = []
+        masks = []
+        tonics = []
+        for keynote, scale_types in scales.items():
+            for scale_name, scale_notes in scale_types.items():
+                pitch_classes = [note_to_pitch_class(note) for note in scale_notes]
+                self.keys.append((keynote, scale_name))
+                masks.append(pitch_class_mask(pc for pc in pitch_classes if pc is not None))
+                tonics.append(note_to_pitch_class(keynote))
+        self.masks = np.array(masks, dtype=np.uint16)
+        self.tonics = np.array([-1 if tonic is None else tonic for tonic in tonics])
+        self.matrix = _mask_matrix(self.masks)
+        self.sizes = self.matrix.sum(axis=1)
+
+_scale_indexes = {}
+
+def _mask_matrix(masks):
+    return ((masks[:, None] >> np.arange(12)) & 1).astype(np.float32)
+
+def get_scale_index(scales):
+    index = _scale_indexes.get(id(scales))
+    if index is None or index.source is not scales:
+        index = ScaleIndex(scales)
+        _scale_indexes[id(scales)] = index
+    return index
+
 def match_chords_to_scales(chords, scales, tolerance=0.0150):
-    chord_names = set(simplify_chord(chord.chord) for chord in chords)
-    print(f"Simplified Chord names: {chord_names}")
-
-    best_match = None
-    best_match_score = 0
-    matched_scales = {}
-    for keynote, scale_types in scales.items():
-        for scale_name, scale_notes in scale_types.items():
-            scale_notes_set = set(scale_notes)
-            print(f"Checking scale: Keynote: {keynote}, Scale: {scale_name}, Notes: {scale_notes_set}")
-
-            intersection_count = len(chord_names.intersection(scale_notes_set))
-            match_score = intersection_count / len(chord_names) if chord_names else 0
-            print(f"Match score for Keynote {keynote}, Scale {scale_name}: {match_score}")
-
-            if match_score >= tolerance:
-                matched_scales[(keynote, scale_name)] = match_score
-                if match_score > best_match_score:
-                    best_match = keynote
-                    best_match_score = match_score
-
-    print(f"Best match: {best_match}, Best match score: {best_match_score}")
-
-    matched_scales_str_keys = {f"{keynote}-{scale_name}": score for (keynote, scale_name), score in matched_scales.items()}
+    occurrences = {}
+    for chord in chords:
+        name = simplify_chord(chord.chord)
+        occurrences[name] = occurrences.get(name, 0) + 1
+    chord_names = [name for name in occurrences if chord_pitch_classes(name)]
+    _log.info("Simplified chord names: %s", chord_names)
+
+    index = get_scale_index(scales)
+    if not chord_names:
+        _log.info("Best match: None, Best match score: 0")
+        return None, {}
+
+    chord_masks = np.array([pitch_class_mask(chord_pitch_classes(name)) for name in chord_names], dtype=np.uint16)
+    chord_matrix = _mask_matrix(chord_masks)
+    chord_sizes = chord_matrix.sum(axis=1)
+
+    # a chord fits a scale when every one of its pitch classes is in the scale
+    fits = (chord_matrix @ index.matrix.T) == chord_sizes[:, None]
+    scores = fits.mean(axis=0)
+
+    # among equal scores the most specific scale wins, then the one whose tonic
+    # roots the most chord occurrences, which separates a key from its relative
+    roots = np.array([parse_chord(name)[0] for name in chord_names])
+    weights = np.array([occurrences[name] for name in chord_names], dtype=float)
+    tonic_weight = (weights[:, None] * (fits & (roots[:, None] == index.tonics))).sum(axis=0)
+    ranking = np.lexsort((np.arange(len(scores)), -tonic_weight, index.sizes, -scores))
+
+    best = ranking[0]
+    best_match = index.keys[best][0] if scores[best] > 0 else None
+    _log.info("Best match: %s, Best match score: %s", best_match, scores[best])
+
+    # ranked order keeps max() over the returned scores on the best scale when scores tie
+    matched_scales_str_keys = {}
+    for i in ranking:
+        if scores[i] >= tolerance:
+            _log.debug("Match score for Keynote %s, Scale %s: %s", *index.keys[i], scores[i])
+            matched_scales_str_keys[f"{index.keys[i][0]}-{index.keys[i][1]}"] = float(scores[i])
     return best_match, matched_scales_str_keys
 
 def load_scales():
@@ -0,0 +1,211 @@
+import argparse
+import glob
+import os
+import queue
+import shutil
+import threading
+import time
+
+_DONE = object()
+
+class YoutubeFetcher:
+    def __init__(self, output_dir=".", use_archive=True):
+        from download_youtube_audio import ARCHIVE_FILE, DownloadArchive
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.archive = DownloadArchive(os.path.join(output_dir, ARCHIVE_FILE)) if use_archive else None
+
+    def __call__(self, song):
+        from download_youtube_audio import download_audio
+        return dict(song, **download_audio(song["url"], self.output_dir, song.get("artist"), song.get("title"),
+                                           archive=self.archive))
+
+class LocalFetcher:
+    """Stands in for YouTube: a url is served from <root>/<video id>.<ext>."""
+
+    def __init__(self, root, output_dir=None):
+        self.root = root
+        self.output_dir = output_dir
+
+    def __call__(self, song):
+        from download_youtube_audio import youtube_video_id
+        video_id = youtube_video_id(song["url"])
+        song = dict(song, artist=song.get("artist") or "Unknown", title=song.get("title") or video_id)
+        matches = sorted(glob.glob(os.path.join(glob.escape(self.root), f"{glob.escape(video_id or '')}.*")))
+        if not video_id or not matches:
+            raise FileNotFoundError(f"no local file for {song['url']} in {self.root}")
+        path = matches[0]
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            name = f"{song['artist']} - {song['title']}{os.path.splitext(path)[1]}".replace("/", "_")
+            path = shutil.copyfile(path, os.path.join(self.output_dir, name))
+        return dict(song, path=path)
+
+def _run_stage(work, inbox, outbox, workers=1):
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def loop():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # let the other workers of this stage see the end too
+                inbox.put(_DONE)
+                break
+            if "error" not in item:
+                try:
+                    item = work(item)
+                except Exception as e:
+                    item = dict(item, error=f"{type(e).__name__}: {e}")
+                    if item.get("audio") is not None:
+                        item["audio"].release()
+            outbox.put(item)
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                outbox.put(_DONE)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def run_pipeline(songs, fetcher=None, fetch_workers=2, queue_size=2, use_cache=True, generate_report=True, db=None):
+    from audio import AudioContext
+    from batch import print_summary
+    from cache import AnalysisCache
+    from cho import analyze_chord_stage, analyze_rhythm_stage, finish_song, is_analysis_cached, save_song_entry
+    from db import ReportUpdater
+    from store import open_store
+
+    fetcher = fetcher or YoutubeFetcher()
+    cache = AnalysisCache(enabled=use_cache)
+
+    def fetch(song):
+        return fetcher(song) if song.get("url") else song
+
+    def decode(song):
+        audio = AudioContext(song["path"])
+        # hashing and decoding are mostly I/O, done here off the analysis threads; a song whose
+        # every stage is cached is not decoded at all, the context still decodes on demand if needed
+        if not is_analysis_cached(audio, cache):
+            audio.load()
+        return dict(song, audio=audio, digest=audio.digest)
+
+    def rhythm(song):
+        return dict(song, rhythm=analyze_rhythm_stage(song["audio"], cache))
+
+    def chords(song):
+        song = dict(song, chords=analyze_chord_stage(song["audio"], cache))
+        song["audio"].release()
+        return song
+
+    # every queue is bounded, so a slow stage holds back the ones before it and only
+    # a few decoded songs are ever in memory at once
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(5)]
+    stages = [(fetch, fetch_workers), (decode, 1), (rhythm, 1), (chords, 1)]
+    for (work, workers), inbox, outbox in zip(stages, queues, queues[1:]):
+        _run_stage(work, inbox, outbox, workers)
+
+    feed_errors = []
+
+    def feed():
+        try:
+            for song in songs:
+                queues[0].put(song)
+        except Exception as e:
+            # a bad manifest line ends the feed; the songs already queued still finish
+            feed_errors.append(e)
+        finally:
+            queues[0].put(_DONE)
+
+    threading.Thread(target=feed, daemon=True).start()
+
+    succeeded, failed = [], []
+    started = time.time()
+    store = open_store(db)
+    # the statistics are written every few songs and once more at the end, not after every song
+    report = ReportUpdater(store) if generate_report else None
+    while True:
+        song = queues[-1].get()
+        if song is _DONE:
+            break
+        error = song.get("error")
+        if error is None:
+            try:
+                song_rhythm, tones_at_beats = song["rhythm"]
+                song_entry, html_file = finish_song(song["path"], song["artist"], song["title"], song["digest"],
+                                                    song_rhythm, tones_at_beats, song["chords"], verbose=False)
+                save_song_entry(song_entry, store)
+                if report is not None:
+                    report.add(song_entry)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+        source = song.get("url") or song.get("path")
+        if error is None:
+            succeeded.append(song)
+            print(f"[ok] {song['artist']} - {song['title']} -> {html_file}")
+        else:
+            failed.append((source, error))
+            print(f"[failed] {source}: {error}")
+    if report is not None:
+        report.close()
+
+    summary = {
+        "succeeded": len(succeeded),
+        "failed": len(failed),
+        "elapsed": time.time() - started,
+        "failures": [{"path": source, "error": error} for source, error in failed],
+    }
+    print_summary(summary)
+    if feed_errors:
+        raise feed_errors[0]
+    return summary
+
+def collect_sources(sources, artist=None, title=None, expand=True):
+    from batch import collect_songs
+    from cho import is_youtube_url
+    from download_youtube_audio import expand_urls, youtube_video_id
+    for source in sources:
+        if not is_youtube_url(source):
+            yield from collect_songs(source)
+        elif expand and youtube_video_id(source) is None:
+            yield from expand_urls([source])
+        else:
+            yield {"url": source, "artist": artist, "title": title}
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and analyze songs with every stage running concurrently.")
+    parser.add_argument("sources", nargs="+",
+                        help="YouTube URLs, directories, glob patterns or CSV/JSONL manifests "
+                             "(path or url, artist, title)")
+    parser.add_argument("-o", "--output-dir", default=".", help="Where downloaded audio is saved")
+    parser.add_argument("--artist", default=None,
+                        help="Artist for video URLs given on the command line (default: from YouTube)")
+    parser.add_argument("--title", default=None,
+                        help="Title for video URLs given on the command line (default: from YouTube)")
+    parser.add_argument("--fetch-workers", type=int, default=2, help="Concurrent downloads")
+    parser.add_argument("--queue-size", type=int, default=2, help="Songs buffered between two stages")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="Download again even if the output directory already has a video")
+    parser.add_argument("--local", default=None, metavar="DIR",
+                        help="Serve URLs from DIR/<video id>.<ext> instead of downloading them")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every analysis stage, ignoring the cache")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--no-report", action="store_true", help="Do not update chords_database.html")
+    args = parser.parse_args()
+
+    if args.local:
+        fetcher = LocalFetcher(args.local, args.output_dir)
+    else:
+        fetcher = YoutubeFetcher(args.output_dir, use_archive=not args.no_archive)
+    # the local stand-in has no playlists to expand
+    sources = collect_sources(args.sources, args.artist, args.title, expand=not args.local)
+    summary = run_pipeline(sources, fetcher=fetcher,
+                           fetch_workers=args.fetch_workers, queue_size=args.queue_size,
+                           use_cache=not args.no_cache, generate_report=not args.no_report, db=args.db)
+    raise SystemExit(1 if summary["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from collections import namedtuple
+import librosa
+import numpy as np
+from audio import as_audio_context
+from tempo import CHANGE_THRESHOLD, CHANGE_WINDOW, LOCAL_WINDOW, local_bpm, tempo_segments
+
+RHYTHM_PARAMS = {"onset_hop_length": 512, "smoothing": LOCAL_WINDOW, "tempo_window": CHANGE_WINDOW,
+                 "tempo_threshold": CHANGE_THRESHOLD, "tempo_drift": True}
+# candidate bar lengths in beats, in order of preference when accents are ambiguous
+METERS = (4, 3, 2)
+
+class Rhythm(namedtuple("Rhythm", ["tempo", "beat_times", "tempo_curve", "tempo_map", "beats_per_bar", "downbeat",
+                                   "bar_times", "duration"])):
+    __slots__ = ()
+
+    @property
+    def meter(self):
+        return f"{self.beats_per_bar}/4" if self.beats_per_bar else "Unknown"
+
+def estimate_meter(beat_strengths, meters=METERS):
+    beat_strengths = np.asarray(beat_strengths, dtype=float)
+    n = len(beat_strengths)
+    best = (0, 0)
+    # accents weaker than this are noise, and the bar falls back to the preferred meter
+    best_contrast = 0.1 * beat_strengths.mean() if n else 0.0
+    for beats_per_bar in meters:
+        if n < 2 * beats_per_bar:
+            continue
+        # accent of each bar position over the beats falling elsewhere
+        phases = np.arange(n) % beats_per_bar
+        counts = np.bincount(phases, minlength=beats_per_bar)
+        sums = np.bincount(phases, weights=beat_strengths, minlength=beats_per_bar)
+        contrast = sums / counts - (sums.sum() - sums) / (n - counts)
+        downbeat = int(np.argmax(contrast))
+        if contrast[downbeat] > best_contrast:
+            best, best_contrast = (beats_per_bar, downbeat), contrast[downbeat]
+    if best == (0, 0) and n >= 2:
+        best = (meters[0], 0)
+    return best
+
+def track_beats(y, sr, hop_length=RHYTHM_PARAMS["onset_hop_length"]):
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
+    return float(np.atleast_1d(tempo)[0]), beat_times, onset_env[beat_frames]
+
+def rhythm_from_beats(tempo, beat_times, beat_strengths, duration, params=RHYTHM_PARAMS):
+    beat_times = np.asarray(beat_times, dtype=float)
+    tempo_curve = local_bpm(beat_times, params["smoothing"])
+    tempo_map = tempo_segments(beat_times, params["tempo_window"], params["tempo_threshold"], params["smoothing"])
+    beats_per_bar, downbeat = estimate_meter(beat_strengths)
+    bar_times = beat_times[downbeat::beats_per_bar] if beats_per_bar else np.zeros(0)
+    return Rhythm(tempo, beat_times, tempo_curve, tempo_map, beats_per_bar, downbeat, bar_times, duration)
+
+def analyze_rhythm(audio, sr=None):
+    y, sr = as_audio_context(audio).load(sr)
+    tempo, beat_times, beat_strengths = track_beats(y, sr)
+    return rhythm_from_beats(tempo, beat_times, beat_strengths, len(y) / sr)
+
+def encode_rhythm(rhythm):
+    return {field: value.tolist() if isinstance(value, np.ndarray) else value
+            for field, value in rhythm._asdict().items()}
+
+def decode_rhythm(cached):
+    return Rhythm(cached["tempo"], np.asarray(cached["beat_times"]), np.asarray(cached["tempo_curve"]),
+                  cached["tempo_map"], cached["beats_per_bar"], cached["downbeat"], np.asarray(cached["bar_times"]),
+                  cached["duration"])
+
+def get_rhythm(audio, cache=None):
+    audio = as_audio_context(audio)
+    if cache is None:
+        return analyze_rhythm(audio)
+    return cache.get_or_compute(audio.digest, "rhythm", dict({"sr": audio.sr}, **RHYTHM_PARAMS),
+                                lambda: analyze_rhythm(audio), encode=encode_rhythm, decode=decode_rhythm)
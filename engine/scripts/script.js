@@ -1,7 +1,128 @@
+// The page only carries the song's title and its data file (songData); the header,
+// the chord list and the tones are rendered here, once per page, from that data.
+const HEADER_TEMPLATE = `
+    <header>
+      <div>
+        <h4>File: <span id="audio-file"></span></h4>
+        <audio controls>
+          Your browser does not support the audio element.
+        </audio>
+        <label for="bpm-input">BPM:</label>
+        <input type="number" id="bpm-input" class="bpm-input" step="1" min="30" max="300" />
+        <button id="update-bpm">Update BPM</button>
+        <button id="vel-up">BPM(+)</button>
+        <button id="vel-down">BPM(-)</button>
+        <div>
+          <label for="keynote">Key:</label>
+          <input type="text" id="keynote" class="keynote" />
+          <button id="transpose-up">Transpose Up (+)</button>
+          <button id="transpose-down">Transpose Down (-)</button><br></br>
+          Transpose: <span id="transpose-counter">0</span>, Capo:
+          <span id="capo-counter">0</span>
+          <input type="radio" id="guitar" name="instrument" value="guitar" checked />
+          <label for="guitar">Guitar</label>
+          <input type="radio" id="ukulele" name="instrument" value="ukulele" />
+          <label for="ukulele">Ukulele</label>
+        </div>
+        <div id="dark-mode-toggle">
+         <button id="toggle-dark-mode">Toggle Dark Mode</button>
+        </div>
+      </div>
+      <div id="chord-diagram-bar">
+        <img id="chord-diagram-current" src="./engine/diagrams/empty.png" />
+        <h1 id="chord-current"></h1>
+        <div style=" width: 2px; height: 100%; display: block; background: #8d94b4; margin: 15px; "></div>
+        <img id="chord-diagram-next" src="./engine/diagrams/empty.png" />
+        <h1 id="chord-next"></h1>
+      </div>
+    </header>
+    <button id="zoom-in">zoom-in(+)</button>
+    <button id="zoom-out">zoom-out(-)</button>
+    <ul id="chords"></ul>
+    <details id="tones-section">
+      <summary><h2 style="display: inline;">Tones at Beats</h2></summary>
+      <ul id="tones-at-beats"></ul>
+    </details>
+`;
+
+// chords are added to the page a batch at a time, as the list is scrolled or played into
+const CHORD_BATCH = 200;
+// a chord is shown as current this many seconds before it starts, so it can be read in time
+const LOOKAHEAD = 0.3;
+
+function renderPage(data) {
+  document.body.insertAdjacentHTML("afterbegin", HEADER_TEMPLATE);
+  const audio = document.querySelector("audio");
+  const source = document.createElement("source");
+  source.src = data.audio;
+  source.type = data.audio_type;
+  audio.prepend(source);
+  document.getElementById("audio-file").textContent = data.audio;
+  document.getElementById("bpm-input").value = data.tempo;
+  document.getElementById("keynote").value = data.keynote || "";
+}
+
+const NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"];
+const FLAT_NOTE_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"];
+// keys written with flats (F, Bb, Eb, Ab, Db), as in viewer.py
+const FLAT_KEYS = [1, 3, 5, 8, 10];
+
+function keyNoteNames(keyRoot) {
+  return FLAT_KEYS.includes(keyRoot) ? FLAT_NOTE_NAMES : NOTE_NAMES;
+}
+
+// viewer.py sends every chord already transposed to all 12 keys; pages from before that
+// only have the chord names, so their table is worked out here once, from the names
+function chordTableFromNames(names, keynoteRoot) {
+  const flats = { "C#": "Db", "D#": "Eb", "F#": "Gb", "G#": "Ab", "A#": "Bb" };
+  const sharps = { Cb: "B", Db: "C#", Eb: "D#", Fb: "E", Gb: "F#", Ab: "G#", Bb: "A#", "E#": "F", "B#": "C" };
+  const table = { names: [], diagrams: [] };
+  for (let shift = 0; shift < 12; shift++) {
+    // the names are kept as written, and spelled for the key they are transposed to
+    const noteNames = keynoteRoot === null ? FLAT_NOTE_NAMES : keyNoteNames((keynoteRoot + shift) % 12);
+    const row = shift === 0 ? names.slice() : names.map((name) => name.replace(/[CDEFGAB](b|#)?/g, function (note) {
+      return noteNames[(NOTE_NAMES.indexOf(sharps[note] || note) + shift) % 12];
+    }));
+    table.names.push(row);
+    table.diagrams.push(row.map((name) => name.replace(/\/.*/, "").replace(/[CDEFGAB]#|Cb|Fb/g,
+      (note) => flats[note] || flats[sharps[note]] || sharps[note])));
+  }
+  return table;
+}
+
+// pages written before the data files list their chords as <li id="timestamp">
+function songDataFromList() {
+  const names = [];
+  const ids = [];
+  const times = [];
+  const bars = [];
+  document.querySelectorAll("#chords li").forEach((item) => {
+    let id = names.indexOf(item.innerHTML);
+    if (id === -1) {
+      id = names.push(item.innerHTML) - 1;
+    }
+    ids.push(id);
+    times.push(parseFloat(item.id));
+    bars.push(parseInt(item.dataset.bar || "0"));
+  });
+  document.getElementById("chords").textContent = "";
+  const keynote = document.getElementById("keynote").value;
+  let keynoteRoot = NOTE_NAMES.indexOf(keynote);
+  keynoteRoot = keynoteRoot === -1 ? FLAT_NOTE_NAMES.indexOf(keynote) : keynoteRoot;
+  keynoteRoot = keynoteRoot === -1 ? null : keynoteRoot;
+  const chords = Object.assign(chordTableFromNames(names, keynoteRoot), { ids: ids, times: times, bars: bars });
+  return { chords: chords, tones: null, keynote_root: keynoteRoot };
+}
+
 document.addEventListener("DOMContentLoaded", function () {
+  const data = window.songData || songDataFromList();
+  if (window.songData) {
+    renderPage(data);
+  }
+
   // Obtener elementos
   const audio = document.querySelector("audio");
-  const chords = document.querySelectorAll("#chords li");
+  const chordList = document.getElementById("chords");
   const transposeCounter = document.getElementById("transpose-counter");
   const transposeUpButton = document.getElementById("transpose-up");
   const transposeDownButton = document.getElementById("transpose-down");
@@ -18,11 +139,56 @@ document.addEventListener("DOMContentLoaded", function () {
   const zoomInButton = document.getElementById("zoom-in");
   const zoomOutButton = document.getElementById("zoom-out");
   const darkModeToggle = document.getElementById("dark-mode-toggle");
+  const tonesSection = document.getElementById("tones-section");
+
+  const times = data.chords.times;
+  const chordIds = data.chords.ids;
+  const chords = [];
+  // transposing only picks another row of the chord table
+  let row = 0;
 
-  let maxChordLength = 0;
   let instrument = "guitar";
   let playbackRate = 1.0;
   let currentBPM = 120;
+  let transposition = 0;
+  let zoom = 1.0;
+
+  const lengths = times.map((time, index) => (index + 1 < times.length ? times[index + 1] - time : 0));
+  const maxChordLength = lengths.reduce((longest, length) => Math.max(longest, length), 0) || 1;
+
+  function chordWidth(index) {
+    return (lengths[index] / maxChordLength) * 400 * zoom;
+  }
+
+  function renderChordsUntil(index) {
+    if (chords.length > index || chords.length === times.length) {
+      return;
+    }
+    const end = Math.min(times.length, Math.max(index + 1, chords.length + CHORD_BATCH));
+    const fragment = document.createDocumentFragment();
+    for (let i = chords.length; i < end; i++) {
+      const chord = document.createElement("li");
+      chord.id = times[i];
+      chord.dataset.bar = data.chords.bars[i];
+      chord.textContent = chordName(i);
+      chord.style.width = chordWidth(i) + "px";
+      chord.style.setProperty("--animation-duration", (lengths[i] / playbackRate) + "s");
+      chords.push(chord);
+      fragment.appendChild(chord);
+    }
+    chordList.appendChild(fragment);
+    chordList.appendChild(moreChords);
+  }
+
+  // an empty marker after the last rendered chord pulls in the next batch when it scrolls into view
+  const moreChords = document.createElement("li");
+  moreChords.style.visibility = "hidden";
+  new IntersectionObserver(function (entries) {
+    if (entries.some((entry) => entry.isIntersecting)) {
+      renderChordsUntil(chords.length);
+    }
+  }).observe(moreChords);
+  renderChordsUntil(0);
 
   function toggleDarkMode() {
     document.body.classList.toggle('dark-mode');
@@ -30,77 +196,73 @@ document.addEventListener("DOMContentLoaded", function () {
 
   darkModeToggle.addEventListener("click", toggleDarkMode);
 
-  chords.forEach((chord) => {
-    chord.addEventListener("click", function () {
+  // one listener for the whole list, rendered chords come and go without their own
+  chordList.addEventListener("click", function (event) {
+    const chord = event.target.closest("li");
+    if (chord && chord !== moreChords) {
       audio.currentTime = chord.id;
       audio.play();
-    });
+    }
   });
 
   document.querySelectorAll('input[name="instrument"]').forEach((input) => {
     input.addEventListener("change", function () {
       instrument = this.value;
+      showDiagrams(true);
     });
   });
 
-  chords.forEach((chord, index) => {
-    var nextChord = chords[index + 1];
-    if (nextChord) {
-      var length = nextChord.id - chord.id;
-      chord.setAttribute("length", length);
-      if (length > maxChordLength) {
-        maxChordLength = length;
+  if (tonesSection && data.tones) {
+    // the tones are only put on the page the first time they are looked at
+    tonesSection.addEventListener("toggle", function () {
+      const tonesList = document.getElementById("tones-at-beats");
+      if (!tonesSection.open || tonesList.childElementCount) {
+        return;
       }
-    }
-  });
-
-  function updateChordWidth() {
-    chords.forEach((chord) => {
-      let length = chord.getAttribute("length");
-      const n = 3;
-      length = parseFloat(length).toFixed(n);
-      let w = (length / maxChordLength.toFixed(n)) * 400;
-      chord.style.width = w + "px";
+      const fragment = document.createDocumentFragment();
+      data.tones.times.forEach((time, index) => {
+        const tone = document.createElement("li");
+        tone.textContent = `Time: ${time.toFixed(2)}s - Tone: ${data.tones.names[data.tones.ids[index]]}`;
+        fragment.appendChild(tone);
+      });
+      tonesList.appendChild(fragment);
     });
   }
 
-  function updateAnimationDuration() {
-    chords.forEach((chord) => {
-      let length = chord.getAttribute("length");
-      chord.style.setProperty("--animation-duration", (length / playbackRate) + "s");
+  function updateChordWidth() {
+    chords.forEach((chord, index) => {
+      chord.style.width = chordWidth(index) + "px";
     });
   }
 
-  updateChordWidth();
-  updateAnimationDuration();
-
-  function scaleChordWidth(x) {
-    chords.forEach((chord) => {
-      let currentWidth = parseFloat(chord.style.width.replace("px", ""));
-      chord.style.width = (currentWidth * x) + "px";
+  function updateAnimationDuration() {
+    chords.forEach((chord, index) => {
+      chord.style.setProperty("--animation-duration", (lengths[index] / playbackRate) + "s");
     });
   }
 
   zoomInButton.addEventListener("click", function () {
-    scaleChordWidth(1.5);
+    zoom *= 1.5;
+    updateChordWidth();
   });
 
   zoomOutButton.addEventListener("click", function () {
-    scaleChordWidth(0.8);
+    zoom *= 0.8;
+    updateChordWidth();
   });
 
   transposeUpButton.addEventListener("click", function () {
     transposeChords(1);
     transposeCounter.innerHTML = parseInt(transposeCounter.innerHTML) + 1;
     capoCounter.innerHTML = transposeCounter.innerHTML * -1;
-    updateKeynote(1);
+    showKeynote();
   });
 
   transposeDownButton.addEventListener("click", function () {
     transposeChords(-1);
     transposeCounter.innerHTML = parseInt(transposeCounter.innerHTML) - 1;
     capoCounter.innerHTML = transposeCounter.innerHTML * -1;
-    updateKeynote(-1);
+    showKeynote();
   });
 
   velUpButton.addEventListener("click", function () {
@@ -130,77 +292,104 @@ document.addEventListener("DOMContentLoaded", function () {
     }
   });
 
-  setInterval(function () {
-    const currentTime = audio.currentTime;
-    chords.forEach((chord) => {
-      if (chord.id <= currentTime) {
-        chord.classList.add("actived");
+  // index of the chord being played, or about to be within LOOKAHEAD seconds; -1 before the first
+  let cursor = -1;
+  let playing = false;
+
+  // last chord starting at or before time, by binary search over the sorted start times
+  function chordAt(time) {
+    let low = 0;
+    let high = times.length;
+    while (low < high) {
+      const middle = (low + high) >> 1;
+      if (times[middle] <= time) {
+        low = middle + 1;
       } else {
-        chord.classList.remove("actived");
-        chord.classList.remove("active");
+        high = middle;
       }
+    }
+    return low - 1;
+  }
 
-      if (chord.id - currentTime <= 0.3 && chord.id - currentTime >= 0) {
-        chord.classList.add("active");
+  function chordName(index) {
+    return data.chords.names[row][chordIds[index]];
+  }
 
-        if (chordCurrent.innerHTML != chord.innerHTML) {
-          chordCurrent.innerHTML = chord.innerHTML;
-          chordDiagramCurrent.src = `./engine/diagrams/${instrument}/${simplifyChord(chord.innerHTML)}.png`;
-        }
+  function diagramSource(index) {
+    const diagram = index >= 0 && index < times.length ? data.chords.diagrams[row][chordIds[index]] : null;
+    return diagram ? `./engine/diagrams/${instrument}/${diagram}.png` : "./engine/diagrams/empty.png";
+  }
 
-        if (chordNext.innerHTML != chord.nextElementSibling.innerHTML) {
-          chordNext.innerHTML = chord.nextElementSibling.innerHTML;
-          chordDiagramNext.src = `./engine/diagrams/${instrument}/${simplifyChord(chord.nextElementSibling.innerHTML)}.png`;
-        }
+  function showDiagrams(force) {
+    const current = cursor >= 0 ? chordName(cursor) : "";
+    const next = cursor + 1 < times.length ? chordName(cursor + 1) : "";
+    if (force || chordCurrent.innerHTML != current) {
+      chordCurrent.innerHTML = current;
+      chordDiagramCurrent.src = diagramSource(cursor);
+    }
+    if (force || chordNext.innerHTML != next) {
+      chordNext.innerHTML = next;
+      chordDiagramNext.src = diagramSource(cursor + 1);
+    }
+  }
+
+  // only the chords between the old and the new cursor change, whatever the length of the song
+  function syncPlayback() {
+    const index = chordAt(audio.currentTime + LOOKAHEAD);
+    if (index === cursor) {
+      return;
+    }
+    renderChordsUntil(index + 1);
+    if (cursor >= 0 && cursor < chords.length) {
+      chords[cursor].classList.remove("active");
+    }
+    for (let i = Math.min(cursor, index) + 1; i <= Math.max(cursor, index); i++) {
+      if (i < chords.length) {
+        chords[i].classList.toggle("actived", i <= index);
       }
-    });
-  }, 150);
+    }
+    if (index >= 0) {
+      chords[index].classList.add("active");
+    }
+    cursor = index;
+    showDiagrams();
+  }
 
-  function transposeChords(amount) {
-    chords.forEach((chord) => {
-      chord.innerHTML = transposeChord(chord.innerHTML, amount);
-    });
+  function followPlayback() {
+    if (playing) {
+      syncPlayback();
+      requestAnimationFrame(followPlayback);
+    }
   }
 
-  function transposeChord(chord, amount) {
-    var scale = [
-      "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"
-    ];
-    var normalizeMap = {
-      Cb: "B", Db: "C#", Eb: "D#", Fb: "E", Gb: "F#", Ab: "G#", Bb: "A#", "E#": "F", "B#": "C"
-    };
-    return chord.replace(/[CDEFGAB](b|#)?/g, function (match) {
-      var i = (scale.indexOf(normalizeMap[match] ? normalizeMap[match] : match) + amount) % scale.length;
-      return scale[i < 0 ? i + scale.length : i];
+  audio.addEventListener("play", function () {
+    if (!playing) {
+      playing = true;
+      requestAnimationFrame(followPlayback);
+    }
+  });
+  audio.addEventListener("pause", function () {
+    playing = false;
+  });
+  audio.addEventListener("ended", function () {
+    playing = false;
+  });
+  // paused seeks and the browser's own progress updates still move the cursor
+  audio.addEventListener("timeupdate", syncPlayback);
+  audio.addEventListener("seeked", syncPlayback);
+
+  function transposeChords(amount) {
+    transposition += amount;
+    row = ((transposition % 12) + 12) % 12;
+    chords.forEach((chord, index) => {
+      chord.textContent = chordName(index);
     });
+    showDiagrams(true);
   }
 
-  function simplifyChord(chord) {
-    const chordMap = {
-      "C#": "Db", "C%23": "Db",
-      "D#": "Eb", "D%23": "Eb",
-      "F#": "Gb", "F%23": "Gb",
-      "G#": "Ab", "G%23": "Ab",
-      "A#": "Bb", "A%23": "Bb",
-    };
-
-    return chord
-      .replace(/\/.*/, "")
-      .replace(/C%23|C#/g, "Db")
-      .replace(/D%23|D#/g, "Eb")
-      .replace(/F%23|F#/g, "Gb")
-      .replace(/G%23|G#/g, "Ab")
-      .replace(/A%23|A#/g, "Bb");
-  }
-
-  function updateKeynote(amount) {
-    const scale = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"];
-    let currentNote = keynoteInput.value;
-    let currentIndex = scale.indexOf(currentNote);
-    if (currentIndex === -1) return;
-
-    let newIndex = (currentIndex + amount) % scale.length;
-    if (newIndex < 0) newIndex += scale.length;
-    keynoteInput.value = scale[newIndex];
+  function showKeynote() {
+    if (data.keynote_root === null || data.keynote_root === undefined) return;
+    const keyRoot = (data.keynote_root + row) % 12;
+    keynoteInput.value = row === 0 && data.keynote ? data.keynote : keyNoteNames(keyRoot)[keyRoot];
   }
 });
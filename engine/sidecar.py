@@ -0,0 +1,120 @@
+import hashlib
+import os
+import re
+import numpy as np
+from chords import NOTE_NAMES, encode_chord_events, note_to_pitch_class
+
+NO_TONE = 255
+ARRAY_FIELDS = ("beat_times", "tones_at_beats", "chord_events")
+# librosa names tones with the unicode sharp, keep them as they were analyzed
+_TONE_NAMES = [name.replace("#", "♯") for name in NOTE_NAMES]
+_TONE = re.compile(r"^(.+?)(-?\d+)$")
+
+def tone_to_midi(tone):
+    match = _TONE.match(tone or "")
+    pitch_class = note_to_pitch_class(match.group(1)) if match else None
+    if pitch_class is None:
+        return NO_TONE
+    midi = 12 * (int(match.group(2)) + 1) + pitch_class
+    return midi if 0 <= midi < NO_TONE else NO_TONE
+
+def midi_to_tone(midi):
+    return f"{_TONE_NAMES[midi % 12]}{midi // 12 - 1}"
+
+def sidecar_name(entry):
+    key = entry.get("id") or hashlib.sha1(f"{entry.get('artist')}\0{entry.get('title')}".encode("utf-8")).hexdigest()
+    return f"{key[:16]}.npz"
+
+def has_arrays(entry):
+    return any(field in entry for field in ARRAY_FIELDS)
+
+def split_entry(entry):
+    tones_at_beats = entry.get("tones_at_beats") or []
+    beat_times = entry.get("beat_times")
+    if beat_times is None:
+        beat_times = [t for t, tone in tones_at_beats]
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+
+    # tones are stored per beat, with NO_TONE on beats where nothing was voiced
+    tones = np.full(len(beat_times), NO_TONE, dtype=np.uint8)
+    if tones_at_beats and len(beat_times):
+        times = np.asarray([t for t, tone in tones_at_beats], dtype=np.float64)
+        beats = np.clip(np.searchsorted(beat_times, times), 0, len(beat_times) - 1)
+        earlier = np.clip(beats - 1, 0, len(beat_times) - 1)
+        beats = np.where(np.abs(beat_times[earlier] - times) < np.abs(beat_times[beats] - times), earlier, beats)
+        tones[beats] = [tone_to_midi(tone) for t, tone in tones_at_beats]
+
+    chord_events = entry.get("chord_events") or encode_chord_events([])
+    arrays = {
+        "beat_times": beat_times.astype(np.float32),
+        "tones": tones,
+        "chord_ids": np.asarray(chord_events["ids"], dtype=np.uint16),
+        "chord_timestamps": np.asarray(chord_events["timestamps"], dtype=np.float32),
+        "chord_names": np.asarray(chord_events["names"], dtype=str),
+    }
+    summary = {k: v for k, v in entry.items() if k not in ARRAY_FIELDS}
+    return summary, arrays
+
+def save_arrays(path, arrays):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    try:
+        # uncompressed, so np.load reads each array only when it is accessed
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_arrays(path):
+    return np.load(path, allow_pickle=False)
+
+class PersistedIndex:
+    """An index built from the database and saved as the arrays ARRAY_NAMES in one .npz file,
+    with the database's updated_at at build time, so a stale file is rebuilt on open."""
+
+    ARRAY_NAMES = ()
+
+    def __init__(self, arrays):
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.db_updated_at = float(arrays["db_updated_at"])
+
+    @classmethod
+    def build(cls, store):
+        raise NotImplementedError
+
+    def save(self, path):
+        arrays = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+        arrays["db_updated_at"] = np.float64(self.db_updated_at)
+        save_arrays(path, arrays)
+
+    @classmethod
+    def load(cls, path):
+        with load_arrays(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    @classmethod
+    def open(cls, path, store, rebuild=False):
+        if not rebuild and os.path.exists(path):
+            index = cls.load(path)
+            if index.db_updated_at >= (store.updated_at() or 0.0):
+                return index
+        index = cls.build(store)
+        index.save(path)
+        return index
+
+def join_entry(summary, arrays):
+    entry = dict(summary)
+    entry.pop("arrays", None)
+    beat_times = arrays["beat_times"].astype(float)
+    tones = arrays["tones"]
+    voiced = np.flatnonzero(tones != NO_TONE)
+    entry["beat_times"] = [round(t, 6) for t in beat_times.tolist()]
+    entry["tones_at_beats"] = [[entry["beat_times"][i], midi_to_tone(int(tones[i]))] for i in voiced]
+    entry["chord_events"] = {
+        "names": arrays["chord_names"].tolist(),
+        "ids": arrays["chord_ids"].tolist(),
+        "timestamps": [round(t, 3) for t in arrays["chord_timestamps"].astype(float).tolist()],
+    }
+    return entry
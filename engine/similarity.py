@@ -0,0 +1,191 @@
+import numpy as np
+from chords import chord_sequence, parse_chord
+from sidecar import PersistedIndex
+from sqlite_store import split_keynote
+from store import iter_latest_songs, open_store
+
+INDEX_FILE = "similarity_index.npz"
+METRICS = ("cosine", "euclidean")
+# every block of the vector is scaled so its length reflects how much it should count
+FEATURE_WEIGHTS = {"chords": 1.0, "transitions": 1.0, "bpm": 0.5, "key": 0.5}
+FEATURE_SIZE = 12 + 12 * 12 + 1 + 3
+_QUERY_CHUNK = 1024
+
+def song_tonic(entry):
+    """Tonic of the song's key as a pitch class and whether the key is minor, or (None, False).
+
+    Keys are taken from the major and minor scales of the keynote scores, the best first.
+    """
+    keynote = entry.get("keynote") or {}
+    best = None
+    for scale_key, score in keynote.items():
+        tonic, scale = split_keynote(scale_key)
+        if scale and scale.endswith(("_major", "_minor")) and (best is None or score > best[0]):
+            best = (score, tonic, scale.endswith("_minor"))
+    if best is None:
+        return None, False
+    parsed = parse_chord(best[1])
+    return (parsed[0] if parsed else None), best[2]
+
+def song_features(entry):
+    """Fixed-length vector of a song: key-relative chord time, chord changes, tempo and key."""
+    tonic, minor = song_tonic(entry)
+    # a minor key is read from its relative major, so A minor and C major songs line up
+    reference = ((tonic or 0) + (3 if minor else 0)) % 12
+
+    chords = np.zeros(12)
+    for name, duration in (entry.get("chord_durations") or {}).items():
+        parsed = parse_chord(name)
+        if parsed is not None:
+            chords[(parsed[0] - reference) % 12] += duration
+
+    transitions = np.zeros((12, 12))
+    roots = [parse_chord(name) for name, timestamp in chord_sequence(entry.get("chord_events"))]
+    roots = [(parsed[0] - reference) % 12 for parsed in roots if parsed is not None]
+    for previous, root in zip(roots, roots[1:]):
+        transitions[previous, root] += 1
+
+    bpm = entry.get("bpm")
+    tempo = np.log2(bpm / 120.0) if isinstance(bpm, (int, float)) and bpm > 0 else 0.0
+    key = np.zeros(3)
+    if tonic is not None:
+        # the tonic goes round the circle of fifths, so keys a fifth apart are close
+        angle = 2 * np.pi * (reference * 7 % 12) / 12
+        key[:] = np.cos(angle), np.sin(angle), 1.0 if minor else -1.0
+
+    blocks = []
+    for name, block in (("chords", chords), ("transitions", transitions.ravel()), ("bpm", np.array([tempo])),
+                        ("key", key)):
+        total = np.linalg.norm(block)
+        if name in ("chords", "transitions") and total > 0:
+            block = block / total
+        blocks.append(block * FEATURE_WEIGHTS[name])
+    return np.concatenate(blocks).astype(np.float32)
+
+class SimilarityIndex(PersistedIndex):
+    """Feature vectors of every song in one matrix, searched for nearest neighbours in batches."""
+
+    ARRAY_NAMES = ("song_ids", "artists", "titles", "matrix")
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self._norms = np.linalg.norm(self.matrix, axis=1)
+        self._unit = self.matrix / np.maximum(self._norms, 1e-12)[:, None]
+        self._positions = {str(song_id): i for i, song_id in enumerate(self.song_ids)}
+
+    @classmethod
+    def build(cls, store=None):
+        store = store or open_store()
+        song_ids, artists, titles, vectors = [], [], [], []
+        for entry in iter_latest_songs(store, full=True):
+            song_ids.append(entry.get("id") or "")
+            artists.append(entry.get("artist", "Unknown"))
+            titles.append(entry.get("title", "Unknown"))
+            vectors.append(song_features(entry))
+        return cls({
+            "song_ids": np.asarray(song_ids, dtype=str),
+            "artists": np.asarray(artists, dtype=str),
+            "titles": np.asarray(titles, dtype=str),
+            "matrix": np.asarray(vectors, dtype=np.float32).reshape(len(vectors), FEATURE_SIZE),
+            "db_updated_at": np.float64(store.updated_at() or 0.0),
+        })
+
+    def position(self, song):
+        """Row of a song given by id, or by an "artist - title" that only one song contains."""
+        if song in self._positions:
+            return self._positions[song]
+        text = song.lower()
+        found = [i for i, (artist, title) in enumerate(zip(self.artists, self.titles))
+                 if text in f"{artist} - {title}".lower()]
+        if len(found) != 1:
+            raise KeyError(f"{len(found)} songs match {song!r}")
+        return found[0]
+
+    def scores(self, vectors, metric="cosine"):
+        """Similarity of every song to each query vector, higher is closer; shape (queries, songs)."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if metric == "cosine":
+            unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, None]
+            return unit @ self._unit.T
+        if metric == "euclidean":
+            # |a - b|^2 = |a|^2 + |b|^2 - 2ab, with the products done as one matrix multiply
+            squared = (vectors * vectors).sum(axis=1)[:, None] + self._norms[None, :] ** 2 - 2 * vectors @ self.matrix.T
+            return -np.sqrt(np.maximum(squared, 0.0))
+        raise ValueError(f"unknown metric {metric!r}, expected one of {METRICS}")
+
+    def nearest(self, positions, k=10, metric="cosine"):
+        """The k nearest songs to each row in positions, as (rows, scores) arrays of shape (len, k).
+
+        The song itself is left out of its own neighbours.
+        """
+        positions = np.atleast_1d(np.asarray(positions))
+        k = min(k, len(self.song_ids) - 1)
+        rows = np.zeros((len(positions), max(k, 0)), dtype=np.int64)
+        scores = np.zeros((len(positions), max(k, 0)), dtype=np.float32)
+        if k <= 0:
+            return rows, scores
+        for start in range(0, len(positions), _QUERY_CHUNK):
+            chunk = positions[start:start + _QUERY_CHUNK]
+            similarity = self.scores(self.matrix[chunk], metric)
+            similarity[np.arange(len(chunk)), chunk] = -np.inf
+            # only the k best of each row are sorted
+            best = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(similarity, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            rows[start:start + len(chunk)] = np.take_along_axis(best, order, axis=1)
+            scores[start:start + len(chunk)] = np.take_along_axis(best_scores, order, axis=1)
+        return rows, scores
+
+    def setlist(self, first, length=10, metric="cosine"):
+        """Rows of a setlist that starts at first and always moves on to the closest song not yet played."""
+        played = [first]
+        remaining = np.ones(len(self.song_ids), dtype=bool)
+        remaining[first] = False
+        while len(played) < min(length, len(self.song_ids)):
+            similarity = self.scores(self.matrix[played[-1]], metric)[0]
+            similarity[~remaining] = -np.inf
+            following = int(np.argmax(similarity))
+            played.append(following)
+            remaining[following] = False
+        return played
+
+    def describe(self, row):
+        return f"{self.artists[row]} - {self.titles[row]} [{self.song_ids[row]}]"
+
+def open_index(path=INDEX_FILE, store=None, rebuild=False):
+    return SimilarityIndex.open(path, store or open_store(), rebuild)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find the songs most like a given one from their stored analysis.")
+    parser.add_argument("song", nargs="?", default=None, help='Song id, or part of "Artist - Title"')
+    parser.add_argument("-k", type=int, default=10, help="Number of similar songs")
+    parser.add_argument("--metric", choices=METRICS, default="cosine")
+    parser.add_argument("--setlist", type=int, default=None, metavar="N",
+                        help="Chain N songs, each followed by the closest one not yet played")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"Index file (default: {INDEX_FILE})")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    index = open_index(args.index, open_store(args.db), rebuild=args.rebuild)
+    if args.song is None:
+        print(f"Index of {len(index.song_ids)} songs: {args.index}")
+        return
+    try:
+        row = index.position(args.song)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    if args.setlist:
+        for number, following in enumerate(index.setlist(row, args.setlist, args.metric), 1):
+            print(f"{number:3d}. {index.describe(following)}")
+        return
+    print(index.describe(row))
+    rows, scores = index.nearest([row], args.k, args.metric)
+    for following, score in zip(rows[0], scores[0]):
+        print(f"  {score:8.3f}  {index.describe(following)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from chords import upgrade_entry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_id TEXT,
+    artist TEXT,
+    title TEXT,
+    bpm REAL,
+    keynote TEXT,
+    scale TEXT,
+    scale_scores TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS chord_counts (
+    song_pk INTEGER NOT NULL REFERENCES songs(pk) ON DELETE CASCADE,
+    chord TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    duration REAL,
+    PRIMARY KEY (song_pk, chord)
+);
+CREATE TABLE IF NOT EXISTS beats (
+    song_pk INTEGER NOT NULL REFERENCES songs(pk) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    time REAL NOT NULL,
+    tone TEXT,
+    PRIMARY KEY (song_pk, idx)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_songs_song_id ON songs(song_id);
+CREATE INDEX IF NOT EXISTS idx_songs_artist ON songs(artist);
+CREATE INDEX IF NOT EXISTS idx_songs_title ON songs(title);
+CREATE INDEX IF NOT EXISTS idx_songs_keynote ON songs(keynote, scale);
+CREATE INDEX IF NOT EXISTS idx_chord_counts_chord ON chord_counts(chord, song_pk);
+"""
+
+SUMMARY_FIELDS = ("id", "artist", "title", "bpm", "keynote", "scale")
+STORED_FIELDS = ("id", "artist", "title", "chords", "chord_durations", "bpm", "beat_times", "tones_at_beats",
+                 "keynote")
+
+def split_keynote(scale_key):
+    if not scale_key or "-" not in scale_key:
+        return scale_key, None
+    return tuple(scale_key.split("-", 1))
+
+def best_scale(scale_scores):
+    if not scale_scores:
+        return None
+    return max(scale_scores, key=scale_scores.get)
+
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chord_counts)")]
+            if "duration" not in columns:
+                conn.execute("ALTER TABLE chord_counts ADD COLUMN duration REAL")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def created_at(self):
+        return os.path.getctime(self.path) if self.exists() else None
+
+    def updated_at(self):
+        return os.path.getmtime(self.path) if self.exists() else None
+
+    def _insert(self, conn, song_entry):
+        song_entry = upgrade_entry(song_entry)
+        scale_scores = song_entry.get("keynote") or {}
+        keynote, scale = split_keynote(best_scale(scale_scores))
+        extra = {k: v for k, v in song_entry.items() if k not in STORED_FIELDS}
+        bpm = song_entry.get("bpm")
+
+        if song_entry.get("id"):
+            conn.execute("DELETE FROM songs WHERE song_id = ?", (song_entry["id"],))
+        else:
+            conn.execute("DELETE FROM songs WHERE song_id IS NULL AND artist = ? AND title = ?",
+                         (song_entry.get("artist"), song_entry.get("title")))
+        cursor = conn.execute(
+            "INSERT INTO songs (song_id, artist, title, bpm, keynote, scale, scale_scores, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (song_entry.get("id"), song_entry.get("artist"), song_entry.get("title"),
+             bpm if isinstance(bpm, (int, float)) else None, keynote, scale,
+             json.dumps(scale_scores), json.dumps(extra, ensure_ascii=False)))
+        song_pk = cursor.lastrowid
+
+        durations = song_entry.get("chord_durations") or {}
+        conn.executemany("INSERT INTO chord_counts (song_pk, chord, count, duration) VALUES (?, ?, ?, ?)",
+                         [(song_pk, chord, count, durations.get(chord))
+                          for chord, count in song_entry["chords"].items()])
+
+        tones_at_beats = song_entry.get("tones_at_beats") or []
+        tones = {round(beat_time, 6): tone for beat_time, tone in tones_at_beats}
+        beat_times = song_entry.get("beat_times") or [beat_time for beat_time, tone in tones_at_beats]
+        conn.executemany("INSERT INTO beats (song_pk, idx, time, tone) VALUES (?, ?, ?, ?)",
+                         [(song_pk, i, t, tones.get(round(t, 6))) for i, t in enumerate(beat_times)])
+
+    def append(self, song_entry):
+        with closing(self._connect()) as conn, conn:
+            self._insert(conn, song_entry)
+        return song_entry
+
+    def append_many(self, song_entries):
+        count = 0
+        with closing(self._connect()) as conn, conn:
+            for song_entry in song_entries:
+                self._insert(conn, song_entry)
+                count += 1
+        return count
+
+    def _entry(self, conn, row):
+        song_pk, song_id, artist, title, bpm, scale_scores, extra = row
+        chord_rows = conn.execute("SELECT chord, count, duration FROM chord_counts WHERE song_pk = ?",
+                                  (song_pk,)).fetchall()
+        beats = conn.execute("SELECT time, tone FROM beats WHERE song_pk = ? ORDER BY idx", (song_pk,)).fetchall()
+        entry = {
+            "id": song_id,
+            "artist": artist,
+            "title": title,
+            "chords": {chord: count for chord, count, duration in chord_rows},
+            "chord_durations": {chord: duration for chord, count, duration in chord_rows if duration is not None},
+            "bpm": bpm,
+            "beat_times": [t for t, tone in beats],
+            "tones_at_beats": [[t, tone] for t, tone in beats if tone is not None],
+            "keynote": json.loads(scale_scores or "{}"),
+        }
+        entry.update(json.loads(extra or "{}"))
+        if "tempo_changes" not in entry:
+            # files written before tempo maps kept every beat time in the beats table
+            entry["tempo_changes"] = entry["beat_times"]
+        return upgrade_entry(entry)
+
+    def iter_songs(self, full=False):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT pk, song_id, artist, title, bpm, scale_scores, extra FROM songs ORDER BY pk")
+            for row in rows:
+                yield self._entry(conn, row)
+
+    def __iter__(self):
+        return self.iter_songs()
+
+    def compact(self):
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
+            return conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def query(self, chord=None, keynote=None, scale=None, artist=None, title=None):
+        if keynote and scale and not scale.startswith(f"{keynote}_"):
+            scale = f"{keynote}_{scale}"
+
+        sql = "SELECT s.song_id, s.artist, s.title, s.bpm, s.keynote, s.scale"
+        params = []
+        if chord:
+            sql += ", c.count FROM songs s JOIN chord_counts c ON c.song_pk = s.pk AND c.chord = ?"
+            params.append(chord)
+        else:
+            sql += " FROM songs s"
+
+        conditions = []
+        for column, value in (("artist", artist), ("title", title), ("keynote", keynote), ("scale", scale)):
+            if value:
+                conditions.append(f"s.{column} = ?")
+                params.append(value)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY s.artist, s.title"
+
+        with closing(self._connect()) as conn:
+            results = []
+            for row in conn.execute(sql, params):
+                result = dict(zip(SUMMARY_FIELDS, row))
+                if chord:
+                    result["count"] = row[-1]
+                results.append(result)
+            return results
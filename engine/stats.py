@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import shutil
+from chords import chord_sequence
+from store import atomic_write, iter_latest_songs, open_store
+
+BPM_BIN_WIDTH = 5
+# rollups small enough to rewrite whole: their size depends on the chord vocabulary, not the library
+ROLLUP_FILES = ("global", "transitions", "bpm")
+# rollups that grow with the library, one file per artist or key, so a song only rewrites the ones it is in
+GROUP_DIRS = ("artists", "keys")
+STATS_SCRIPT = "stats.js"
+STATE_FILE = "state.json"
+STATS_LAYOUT = "grouped"
+# what each song added to the rollups, one small file per song, so a re-analyzed song can be taken out again
+SONGS_DIR = "songs"
+# songs added between two writes of the rollups when songs come in a batch
+FLUSH_EVERY = 50
+
+def best_keynote(entry):
+    keynote = entry.get("keynote") or {}
+    return max(keynote, key=keynote.get, default="Unknown")
+
+def song_key(entry):
+    return entry.get("id") or f"{entry.get('artist', 'Unknown')}\u0000{entry.get('title', 'Unknown')}"
+
+def song_contribution(entry):
+    counts = entry.get("chords") or {}
+    durations = entry.get("chord_durations") or {}
+    sequence = [name for name, timestamp in chord_sequence(entry.get("chord_events"))]
+    transitions = {}
+    for previous, chord in zip(sequence, sequence[1:]):
+        following = transitions.setdefault(previous, {})
+        following[chord] = following.get(chord, 0) + 1
+    bpm = entry.get("bpm")
+    bpm_bin = None
+    if isinstance(bpm, (int, float)) and bpm > 0:
+        bpm_bin = str(int(bpm // BPM_BIN_WIDTH * BPM_BIN_WIDTH))
+    return {
+        "artist": entry.get("artist", "Unknown"),
+        "keynote": best_keynote(entry),
+        "chords": {chord: [count, durations.get(chord, 0.0)] for chord, count in counts.items() if chord != "N"},
+        "transitions": transitions,
+        "bpm_bin": bpm_bin,
+    }
+
+def _hashed_path(stats_dir, directory, name):
+    return os.path.join(stats_dir, directory, f"{hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]}.json")
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_json(path, value):
+    payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    atomic_write(path, lambda f: f.write(payload))
+
+def _add_count(counts, name, amount):
+    counts[name] = counts.get(name, 0) + amount
+    if not counts[name]:
+        del counts[name]
+
+def _add_chords(totals, chords, sign):
+    for chord, (count, duration) in chords.items():
+        total = totals.setdefault(chord, {"count": 0, "duration": 0.0, "songs": 0})
+        total["count"] += sign * count
+        total["duration"] = round(total["duration"] + sign * duration, 3)
+        total["songs"] += sign
+        if not total["songs"]:
+            del totals[chord]
+
+class ChordRollups:
+    """Chord statistics over the whole database, kept up to date one song at a time.
+
+    The artist and key rollups are read from disk only for the artists and keys a song is in.
+    """
+
+    def __init__(self, stats_dir, db_path=None, on_disk=False):
+        self.stats_dir = stats_dir
+        self.db_path = db_path
+        # whether the files in stats_dir match these rollups, so missing entries can be read from them
+        self.on_disk = on_disk
+        self.rollups = {
+            "global": {"songs": 0, "chords": {}},
+            "transitions": {},
+            "bpm": {"bin_width": BPM_BIN_WIDTH, "counts": {}},
+        }
+        self.groups = {group: {} for group in GROUP_DIRS}
+        # what changed since the last export: contributions of added songs, artists and keys touched
+        self.added = {}
+        self.touched = {group: set() for group in GROUP_DIRS}
+        self._marked = False
+
+    def group(self, group, name):
+        rollups = self.groups[group]
+        if name not in rollups:
+            stored = _read_json(_hashed_path(self.stats_dir, group, name)) if self.on_disk else None
+            rollups[name] = {"songs": stored["songs"], "chords": stored["chords"]} if stored else None
+        if rollups[name] is None:
+            rollups[name] = {"songs": 0, "chords": {}}
+        return rollups[name]
+
+    def contribution(self, key):
+        if key in self.added:
+            return self.added[key]
+        return _read_json(_hashed_path(self.stats_dir, SONGS_DIR, key)) if self.on_disk else None
+
+    def apply(self, contribution, sign=1):
+        """Add a song's contribution to the rollups, or take it out again with sign=-1."""
+        rollups = self.rollups
+        rollups["global"]["songs"] += sign
+        _add_chords(rollups["global"]["chords"], contribution["chords"], sign)
+        for group, name in (("artists", contribution["artist"]), ("keys", contribution["keynote"])):
+            rollup = self.group(group, name)
+            rollup["songs"] += sign
+            _add_chords(rollup["chords"], contribution["chords"], sign)
+            self.touched[group].add(name)
+
+        transitions = rollups["transitions"]
+        for previous, following in contribution["transitions"].items():
+            counts = transitions.setdefault(previous, {})
+            for chord, count in following.items():
+                _add_count(counts, chord, sign * count)
+            if not counts:
+                del transitions[previous]
+
+        if contribution["bpm_bin"] is not None:
+            _add_count(rollups["bpm"]["counts"], contribution["bpm_bin"], sign)
+
+    def add_song(self, entry):
+        """Count a song; what an earlier analysis of the same song added is taken out first."""
+        if self.on_disk and not self._marked:
+            # until the next export the files on disk miss this song, a crash in between means a rebuild
+            self._write_state(complete=False)
+            self._marked = True
+        key = song_key(entry)
+        previous = self.contribution(key)
+        if previous is not None:
+            self.apply(previous, -1)
+        contribution = song_contribution(entry)
+        self.apply(contribution)
+        self.added[key] = contribution
+
+    def _write_state(self, complete):
+        state = {"db": self.db_path, "layout": STATS_LAYOUT, "complete": complete}
+        atomic_write(os.path.join(self.stats_dir, STATE_FILE), lambda f: json.dump(state, f, ensure_ascii=False))
+
+    def export(self):
+        for directory in (SONGS_DIR, *GROUP_DIRS):
+            os.makedirs(os.path.join(self.stats_dir, directory), exist_ok=True)
+        for key, contribution in self.added.items():
+            _write_json(_hashed_path(self.stats_dir, SONGS_DIR, key), contribution)
+        for group, names in self.touched.items():
+            for name in names:
+                rollup = self.groups[group][name]
+                path = _hashed_path(self.stats_dir, group, name)
+                if rollup["songs"]:
+                    _write_json(path, dict(rollup, name=name))
+                elif os.path.exists(path):
+                    os.remove(path)
+        for name in ROLLUP_FILES:
+            _write_json(os.path.join(self.stats_dir, f"{name}.json"), self.rollups[name])
+        # pages opened from disk cannot fetch() the JSON files, so they get the same data as a script
+        payload = json.dumps(self.rollups, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+        atomic_write(os.path.join(self.stats_dir, STATS_SCRIPT), lambda f: f.write(f"var chordStats = {payload};\n"))
+        self._write_state(complete=True)
+        self.added = {}
+        self.touched = {group: set() for group in GROUP_DIRS}
+        self.on_disk = True
+        self._marked = False
+
+    @classmethod
+    def load(cls, stats_dir, db_path):
+        try:
+            state = _read_json(os.path.join(stats_dir, STATE_FILE))
+            if not state or state.get("db") != db_path or state.get("layout") != STATS_LAYOUT:
+                return None
+            # rollups left half written by an interrupted batch are rebuilt
+            if not state.get("complete"):
+                return None
+            rollups = cls(stats_dir, db_path, on_disk=True)
+            for name in ROLLUP_FILES:
+                rollups.rollups[name] = _read_json(os.path.join(stats_dir, f"{name}.json"))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if any(rollup is None for rollup in rollups.rollups.values()):
+            return None
+        return rollups
+
+def build_rollups(stats_dir, store=None):
+    store = store or open_store()
+    rollups = ChordRollups(stats_dir, os.path.abspath(store.path))
+    # the transitions need the chord timeline, which slim entries keep in their sidecar
+    for entry in iter_latest_songs(store, full=True):
+        rollups.add_song(entry)
+    return rollups
+
+def rebuild_stats(stats_dir, store=None):
+    rollups = build_rollups(stats_dir, store)
+    # songs, artists and keys left over from an earlier database must not be read back into this one
+    for directory in (SONGS_DIR, *GROUP_DIRS):
+        shutil.rmtree(os.path.join(stats_dir, directory), ignore_errors=True)
+    for name in GROUP_DIRS:
+        # single-file rollups from before the artists and keys were split
+        if os.path.exists(os.path.join(stats_dir, f"{name}.json")):
+            os.remove(os.path.join(stats_dir, f"{name}.json"))
+    rollups.export()
+    return rollups
+
+class StatsUpdater:
+    """Adds songs to the rollups of a stats directory, written out every flush_every songs and on close()."""
+
+    def __init__(self, stats_dir, store=None, flush_every=FLUSH_EVERY):
+        self.stats_dir = stats_dir
+        self.store = store or open_store()
+        self.flush_every = flush_every
+        self.rollups = None
+        self.pending = 0
+
+    def add(self, song_entry):
+        if self.rollups is None:
+            self.rollups = ChordRollups.load(self.stats_dir, os.path.abspath(self.store.path))
+            if self.rollups is None:
+                # nothing to add to: rebuilt from the db, which already holds this song
+                self.rollups = rebuild_stats(self.stats_dir, self.store)
+                return
+        try:
+            self.rollups.add_song(song_entry)
+        except (OSError, json.JSONDecodeError):
+            self.rebuild()
+            return
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def rebuild(self):
+        self.rollups = rebuild_stats(self.stats_dir, self.store)
+        self.pending = 0
+
+    def discard(self):
+        """Forget the rollups held in memory, after something else rewrote the stats directory."""
+        self.rollups = None
+        self.pending = 0
+
+    def flush(self):
+        if self.rollups is not None and self.pending:
+            self.rollups.export()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def update_stats(song_entry, stats_dir, store=None):
+    with StatsUpdater(stats_dir, store) as updater:
+        updater.add(song_entry)
+    return updater.rollups
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild the chord statistics the database charts load.")
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--stats-dir", default="chords_database_stats", help="Where the JSON rollups are written")
+    args = parser.parse_args()
+    rollups = rebuild_stats(args.stats_dir, open_store(args.db))
+    print(f"Statistics for {rollups.rollups['global']['songs']} songs written to {args.stats_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+from chords import upgrade_entry
+
+DB_FILE = os.environ.get("CHORDYZER_DB", "chords_db.jsonl")
+LEGACY_DB_FILE = "chords_db.json"
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+def _song_key(entry):
+    return entry.get("id") or (entry.get("artist"), entry.get("title"))
+
+def atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class JsonlStore:
+    def __init__(self, path=DB_FILE, legacy_path=LEGACY_DB_FILE, arrays_dir=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        # per-beat and per-chord arrays live in one .npz sidecar per song next to the db
+        self.arrays_dir = arrays_dir or f"{os.path.splitext(path)[0]}_arrays"
+
+    def exists(self):
+        return os.path.exists(self.path) or bool(self.legacy_path and os.path.exists(self.legacy_path))
+
+    def _files(self):
+        return [p for p in (self.legacy_path, self.path) if p and os.path.exists(p)]
+
+    def created_at(self):
+        return min((os.path.getctime(p) for p in self._files()), default=None)
+
+    def updated_at(self):
+        return max((os.path.getmtime(p) for p in self._files()), default=None)
+
+    def _arrays_path(self, entry):
+        return os.path.join(os.path.dirname(self.path), entry["arrays"])
+
+    def _split(self, song_entry):
+        from sidecar import has_arrays, save_arrays, sidecar_name, split_entry
+        if not has_arrays(song_entry):
+            return song_entry
+        summary, arrays = split_entry(song_entry)
+        summary["arrays"] = os.path.relpath(os.path.join(self.arrays_dir, sidecar_name(song_entry)),
+                                            os.path.dirname(self.path) or ".")
+        save_arrays(self._arrays_path(summary), arrays)
+        return summary
+
+    def load_arrays(self, entry):
+        from sidecar import load_arrays
+        return load_arrays(self._arrays_path(entry)) if entry.get("arrays") else None
+
+    def append(self, song_entry):
+        # the sidecar is written first, so a db line never points at a missing file
+        line = json.dumps(self._split(song_entry), ensure_ascii=False) + "\n"
+        with open(self.path, "a+b") as f:
+            # a torn last line from an interrupted write is left on its own line
+            # so the reader can skip it without losing the next entry
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        return song_entry
+
+    def _iter_legacy(self):
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Warning: {self.legacy_path} is corrupted, skipping it")
+            return
+        for entry in legacy:
+            yield upgrade_entry(entry)
+
+    def iter_songs(self, full=False):
+        for entry in self._iter_entries():
+            if full and entry.get("arrays"):
+                from sidecar import join_entry
+                with self.load_arrays(entry) as arrays:
+                    entry = join_entry(entry, arrays)
+            yield entry
+
+    def _iter_entries(self):
+        yield from self._iter_legacy()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: skipping corrupted entry at {self.path}:{line_number}")
+                    continue
+                yield upgrade_entry(entry)
+
+    def __iter__(self):
+        return self.iter_songs()
+
+    def compact(self):
+        songs = {}
+        for entry in self._iter_entries():
+            key = _song_key(entry)
+            songs.pop(key, None)
+            # entries written before sidecars keep their arrays inline, move them out
+            songs[key] = self._split(entry)
+
+        def write(f):
+            for entry in songs.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        atomic_write(self.path, write)
+        if os.path.isdir(self.arrays_dir):
+            referenced = {os.path.normpath(self._arrays_path(entry)) for entry in songs.values() if entry.get("arrays")}
+            for name in os.listdir(self.arrays_dir):
+                path = os.path.normpath(os.path.join(self.arrays_dir, name))
+                if path not in referenced:
+                    os.remove(path)
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+        return len(songs)
+
+def iter_latest_songs(store, full=False):
+    # a re-analyzed song is appended again, only its latest entry counts
+    latest = {_song_key(entry): i for i, entry in enumerate(store.iter_songs())}
+    for i, entry in enumerate(store.iter_songs(full=full)):
+        if latest[_song_key(entry)] == i:
+            yield entry
+
+def open_store(path=None):
+    path = path or DB_FILE
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        from sqlite_store import SqliteStore
+        return SqliteStore(path)
+    return JsonlStore(path, legacy_path=LEGACY_DB_FILE if path == DB_FILE else None)
+
+def migrate(source, target):
+    target_store = open_store(target)
+    if isinstance(target_store, JsonlStore):
+        for entry in source.iter_songs(full=True):
+            target_store.append(entry)
+        return target_store.compact()
+    return target_store.append_many(source.iter_songs(full=True))
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and query the chords database.")
+    parser.add_argument("command", choices=["compact", "migrate", "query"])
+    parser.add_argument("--db", default=None, help="Database file, .jsonl or .sqlite (default: chords_db.jsonl)")
+    parser.add_argument("--to", default=None, help="migrate: target database file, e.g. chords_db.sqlite")
+    parser.add_argument("--chord", default=None, help="query: songs using this chord, e.g. Bbm7")
+    parser.add_argument("--keynote", default=None, help="query: songs in this key, e.g. D")
+    parser.add_argument("--scale", default=None, help="query: scale within the key, e.g. minor or D_minor")
+    parser.add_argument("--artist", default=None)
+    parser.add_argument("--title", default=None)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        store = open_store(args.db)
+        count = store.compact()
+        print(f"Compacted database: {count} songs")
+        from db import report_files, rebuild_report
+        if os.path.exists(report_files()["state"]):
+            rebuild_report(store)
+    elif args.command == "migrate":
+        if not args.to:
+            parser.error("migrate requires --to")
+        count = migrate(open_store(args.db), args.to)
+        print(f"Migrated {count} songs to {args.to}")
+    elif args.command == "query":
+        store = open_store(args.db)
+        if not hasattr(store, "query"):
+            parser.error("query needs a SQLite database, see 'migrate'")
+        for song in store.query(chord=args.chord, keynote=args.keynote, scale=args.scale,
+                                artist=args.artist, title=args.title):
+            print(f"{song['artist']} - {song['title']} | BPM: {song['bpm']} | Key: {song['scale'] or song['keynote']}"
+                  + (f" | {args.chord} x{song['count']}" if args.chord else ""))
+
+if __name__ == "__main__":
+    main()
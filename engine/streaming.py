@@ -0,0 +1,112 @@
+import shutil
+import numpy as np
+import librosa
+import soxr
+from audio import AudioContext, DEFAULT_SR, FfmpegStream
+from music import ChordChange, analyze_pitch_at_beats, extract_chords_from_audio
+from rhythm import rhythm_from_beats, track_beats
+
+WINDOW_SECONDS = 60.0
+OVERLAP_SECONDS = 10.0
+STREAM_FRAME = 2048
+
+def iter_audio_windows(audio_file, sr=DEFAULT_SR, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    # ffmpeg reads every format the downloads come in; libsndfile, behind librosa.stream, cannot open webm or m4a
+    stream = FfmpegStream(audio_file) if shutil.which("ffmpeg") else None
+    native_sr = stream.sr if stream is not None else librosa.get_samplerate(audio_file)
+    block_length = max(int(np.ceil((window_seconds - overlap_seconds) * native_sr / STREAM_FRAME)), 1)
+    if stream is not None:
+        blocks = stream.blocks(block_length * STREAM_FRAME)
+    else:
+        blocks = librosa.stream(audio_file, block_length=block_length, frame_length=STREAM_FRAME,
+                                hop_length=STREAM_FRAME, mono=True)
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32") if native_sr != sr else None
+    overlap = int(overlap_seconds * sr)
+
+    # each window is the tail of the previous one followed by the next block, so at
+    # most window_seconds of audio are held in memory however long the file is
+    tail = np.zeros(0, dtype=np.float32)
+    start = 0
+    block = next(blocks, None)
+    while block is not None:
+        following = next(blocks, None)
+        if resampler is not None:
+            block = resampler.resample_chunk(block, last=following is None)
+        window = np.concatenate((tail, block))
+        yield start - len(tail), window, following is None
+        tail = window[-overlap:] if overlap else window[:0]
+        start += len(block)
+        block = following
+
+def analyze_window(y, sr, offset, core_start, core_end):
+    audio = AudioContext.from_buffer(y, sr)
+    tempo, beat_times, beat_strengths = track_beats(y, sr)
+    beat_times = beat_times + offset
+
+    # the tone of a beat spans up to the next beat, which for the last core beats
+    # lies in the overlap, so pitch is analyzed over every beat of the window
+    in_core = (beat_times >= core_start) & (beat_times < core_end)
+    medians, _ = analyze_pitch_at_beats(audio, beat_times - offset)
+    voiced = np.flatnonzero(in_core[:len(medians)] & ~np.isnan(medians))
+    notes = librosa.midi_to_note(medians[voiced]) if voiced.size else []
+    tones = [(float(beat_times[i]), str(note)) for i, note in zip(voiced, notes)]
+
+    chords = []
+    for chord in extract_chords_from_audio(audio):
+        timestamp = chord.timestamp + offset
+        if timestamp < core_start:
+            # the chord sounding when the core region starts opens it
+            chords[:] = [ChordChange(chord=chord.chord, timestamp=core_start)]
+        elif timestamp < core_end:
+            chords.append(ChordChange(chord=chord.chord, timestamp=timestamp))
+    return {
+        "start": core_start,
+        "end": min(core_end, offset + len(y) / sr),
+        "tempo": tempo,
+        "beats": beat_times[in_core].tolist(),
+        "beat_strengths": beat_strengths[in_core].tolist(),
+        "tones": tones,
+        "chords": chords,
+    }
+
+def stream_analysis(audio_file, sr=DEFAULT_SR, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    last_beat = None
+    last_chord = None
+    for window_start, y, last in iter_audio_windows(audio_file, sr, window_seconds, overlap_seconds):
+        offset = window_start / sr
+        # core regions split the timeline at the middle of each overlap, so every
+        # beat and chord change is reported by exactly one window
+        core_start = offset + overlap_seconds / 2 if window_start > 0 else 0.0
+        core_end = np.inf if last else offset + len(y) / sr - overlap_seconds / 2
+        result = analyze_window(y, sr, offset, core_start, core_end)
+
+        # both windows may find a beat right at the seam; keep the earlier one
+        if last_beat is not None and result["beats"]:
+            min_gap = 30.0 / result["tempo"] if result["tempo"] > 0 else 0.0
+            kept = {t for t in result["beats"] if t - last_beat >= min_gap}
+            result["beat_strengths"] = [strength for t, strength in zip(result["beats"], result["beat_strengths"])
+                                        if t in kept]
+            result["beats"] = [t for t in result["beats"] if t in kept]
+            result["tones"] = [tone for tone in result["tones"] if tone[0] in kept]
+        if result["beats"]:
+            last_beat = result["beats"][-1]
+
+        # a chord that carries on across the seam is not a new change
+        if result["chords"] and result["chords"][0].chord == last_chord:
+            result["chords"] = result["chords"][1:]
+        if result["chords"]:
+            last_chord = result["chords"][-1].chord
+        yield result
+
+def analyze_stream(audio_file, sr=DEFAULT_SR, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    beat_times, beat_strengths, tones_at_beats, chords = [], [], [], []
+    duration = 0.0
+    for result in stream_analysis(audio_file, sr, window_seconds, overlap_seconds):
+        beat_times.extend(result["beats"])
+        beat_strengths.extend(result["beat_strengths"])
+        tones_at_beats.extend(result["tones"])
+        chords.extend(result["chords"])
+        duration = result["end"]
+
+    tempo = 60.0 / float(np.median(np.diff(beat_times))) if len(beat_times) > 1 else 0.0
+    return rhythm_from_beats(tempo, beat_times, beat_strengths, duration), tones_at_beats, chords
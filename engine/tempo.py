@@ -0,0 +1,75 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+LOCAL_WINDOW = 5
+CHANGE_WINDOW = 8
+CHANGE_THRESHOLD = 0.04
+
+def local_bpm(beat_times, window=LOCAL_WINDOW):
+    intervals = np.diff(np.asarray(beat_times, dtype=float))
+    if len(intervals) == 0:
+        return np.zeros(0)
+    window = min(window, len(intervals))
+    # a centered running median, so a missed or doubled beat does not show up as a tempo swing
+    padded = np.pad(intervals, (window // 2, (window - 1) // 2), mode="edge")
+    return 60.0 / np.median(sliding_window_view(padded, window), axis=1)
+
+def tempo_change_points(bpm, window=CHANGE_WINDOW, threshold=CHANGE_THRESHOLD):
+    bpm = np.asarray(bpm, dtype=float)
+    n = len(bpm)
+    if n < 2 * window:
+        return np.zeros(0, dtype=int)
+
+    # mean tempo of the window before and after every interval boundary, from one cumulative sum
+    sums = np.concatenate(([0.0], np.cumsum(bpm)))
+    bounds = np.arange(window, n - window + 1)
+    before = (sums[bounds] - sums[bounds - window]) / window
+    after = (sums[bounds + window] - sums[bounds]) / window
+    jumps = np.abs(after - before) / before
+
+    # a change point is the strongest jump within a window on either side
+    peaks = sliding_window_view(np.pad(jumps, window), 2 * window + 1).max(axis=1)
+    points = []
+    for point in bounds[(jumps > threshold) & (jumps >= peaks)]:
+        if not points or point - points[-1] >= window:
+            points.append(point)
+    return np.asarray(points, dtype=int)
+
+def tempo_drift_points(bpm, bounds, window=CHANGE_WINDOW, threshold=CHANGE_THRESHOLD):
+    # a gradual drift has no jump between neighbouring windows; a segment is split again while
+    # the straight line fitted to its tempo strays from the segment's mean by more than the threshold
+    bpm = np.asarray(bpm, dtype=float)
+    pending = list(zip(bounds[:-1], bounds[1:]))
+    points = []
+    while pending:
+        start, end = pending.pop()
+        segment = bpm[start:end]
+        n = len(segment)
+        if n < 2 * window:
+            continue
+        mean = segment.mean()
+        x = np.arange(n) - (n - 1) / 2
+        slope = x @ (segment - mean) / (x @ x)
+        if abs(slope) * (n - 1) / 2 <= threshold * mean:
+            continue
+        # the split goes where the running deviation from the mean peaks: the middle of a ramp
+        deviation = np.abs(np.cumsum(segment - mean)[window - 1:n - window])
+        point = start + window + int(np.argmax(deviation))
+        points.append(point)
+        pending.extend(((start, point), (point, end)))
+    return np.asarray(sorted(points), dtype=int)
+
+def tempo_segments(beat_times, window=CHANGE_WINDOW, threshold=CHANGE_THRESHOLD, local_window=LOCAL_WINDOW):
+    beat_times = np.asarray(beat_times, dtype=float)
+    if len(beat_times) < 2:
+        return []
+    bpm = local_bpm(beat_times, local_window)
+    points = tempo_change_points(bpm, window, threshold)
+    drift = tempo_drift_points(bpm, np.concatenate(([0], points, [len(bpm)])), window, threshold)
+    points = np.sort(np.concatenate((points, drift)))
+    bounds = np.concatenate(([0], points, [len(beat_times) - 1]))
+    starts = beat_times[bounds[:-1]]
+    ends = beat_times[bounds[1:]]
+    tempos = 60.0 * np.diff(bounds) / (ends - starts)
+    return [[round(float(start), 3), round(float(end), 3), round(float(bpm), 2)]
+            for start, end, bpm in zip(starts, ends, tempos)]
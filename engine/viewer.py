@@ -1,7 +1,95 @@
-from scales import scales
 import os
-import json
-from chord_extractor.extractors import Chordino
+import bisect
+from html import escape
+from string import Template
+from urllib.parse import quote
+from chords import NOTE_NAMES, canonical_quality, chord_family, note_to_pitch_class, parse_chord
+from db import json_for_script
+
+# downloads keep their native container, so the player has to be told which one it gets
+AUDIO_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".webm": "audio/webm",
+    ".opus": "audio/ogg",
+    ".ogg": "audio/ogg",
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+}
+
+# the diagrams are named with flats (see diagrams/guitar/chords_guide.txt), whatever key the chord names are spelled in
+DIAGRAM_NOTE_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+DIAGRAM_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "diagrams", "guitar")
+# keys written with flats (F, Bb, Eb, Ab, Db); the chords of a song transposed into one are spelled with flats too
+FLAT_KEYS = {1, 3, 5, 8, 10}
+_FAMILY_DIAGRAMS = {"maj": "", "m": "m", "dim": "dim", "aug": "aug", "sus": "sus", "5": ""}
+_diagram_names = None
+
+def _diagram(root, quality):
+    global _diagram_names
+    if _diagram_names is None:
+        files = os.listdir(DIAGRAM_DIR) if os.path.isdir(DIAGRAM_DIR) else []
+        _diagram_names = {os.path.splitext(name)[0] for name in files}
+    note = DIAGRAM_NOTE_NAMES[root]
+    # chords without a diagram of their own get the plain chord of their family
+    for name in (note + canonical_quality(quality), note + _FAMILY_DIAGRAMS[chord_family(quality)]):
+        if name in _diagram_names:
+            return name
+    return None
+
+def _spelling(keynote_root, shift):
+    if shift == 0:
+        return None
+    # with no key to go by, the names are spelled like the diagrams
+    if keynote_root is None or (keynote_root + shift) % 12 in FLAT_KEYS:
+        return DIAGRAM_NOTE_NAMES
+    return NOTE_NAMES
+
+def chord_table(names, keynote_root=None):
+    """Every distinct chord parsed into root, quality and bass ids, with its name and
+    diagram in each of the 12 transpositions, so the page transposes by table lookup.
+
+    The untransposed row keeps the names as written; the others are spelled for the key they transpose to."""
+    qualities, roots, quality_ids, basses = [], [], [], []
+    for name in names:
+        parsed = parse_chord(name)
+        root, quality, bass = parsed if parsed is not None else (None, None, None)
+        if quality is not None and quality not in qualities:
+            qualities.append(quality)
+        roots.append(-1 if root is None else root)
+        quality_ids.append(-1 if quality is None else qualities.index(quality))
+        basses.append(-1 if bass is None else bass)
+
+    table_names, table_diagrams = [], []
+    for shift in range(12):
+        row_names, row_diagrams = [], []
+        note_names = _spelling(keynote_root, shift)
+        for name, root, quality_id, bass in zip(names, roots, quality_ids, basses):
+            if root < 0:
+                # "N" and anything unparsed read the same in every key
+                row_names.append(name)
+                row_diagrams.append("N" if name == "N" else None)
+                continue
+            quality = qualities[quality_id]
+            if note_names is None:
+                row_names.append(name)
+            else:
+                transposed = note_names[(root + shift) % 12] + quality
+                if bass >= 0:
+                    transposed += "/" + note_names[(bass + shift) % 12]
+                row_names.append(transposed)
+            row_diagrams.append(_diagram((root + shift) % 12, quality))
+        table_names.append(row_names)
+        table_diagrams.append(row_diagrams)
+    return {
+        "roots": roots,
+        "qualities": quality_ids,
+        "basses": basses,
+        "quality_names": qualities,
+        "names": table_names,
+        "diagrams": table_diagrams,
+    }
 
 def sanitize_filename(input_str):
     import unicodedata
@@ -11,90 +99,78 @@ def sanitize_filename(input_str):
     return sanitized.strip().replace(' ', '_')
 
 def sanitize_url(url):
-    from urllib.parse import quote
     return quote(url, safe='/:')
 
-def generate_html_with_chords(audio_file, chords, artist_name, song_title, tempo, beat_times, tones_at_beats, keynote):
+# the page is the same for every song apart from its title and data file, so it is a
+# template compiled once; everything else is rendered by script.js from the data file
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <link rel="icon" href="./favicon.ico" sizes="any">
+    <link rel="icon" href="./favicon.svg" type="image/svg+xml">
+    <meta charset="UTF-8">
+    <title>Chords from $artist - $title</title>
+    <link rel="stylesheet" type="text/css" href="./engine/scripts/style.css" />
+    <script src="./$data_file"></script>
+    <script src="./engine/scripts/script.js"></script>
+</head>
+<body>
+</body>
+</html>
+""")
+
+def _columns(values):
+    # repeated strings (chord and tone names) are sent once, each event refers to them by index
+    names, ids, lookup = [], [], {}
+    for value in values:
+        if value not in lookup:
+            lookup[value] = len(names)
+            names.append(value)
+        ids.append(lookup[value])
+    return names, ids
+
+def song_data(audio_file, chords, artist_name, song_title, tempo, tones_at_beats, keynote, bar_times=None):
+    timestamps = [round(float(getattr(chord, 'timestamp', 0.0)), 3) for chord in chords]
+    chord_names, chord_ids = _columns(getattr(chord, 'chord', 'Unknown') for chord in chords)
+    bar_times = list(bar_times) if bar_times is not None else []
+    tone_names, tone_ids = _columns(str(tone) for beat_time, tone in tones_at_beats)
+    keynote_root = note_to_pitch_class(keynote) if keynote else None
+    return {
+        "artist": artist_name,
+        "title": song_title,
+        "audio": sanitize_url(audio_file),
+        "audio_type": AUDIO_TYPES.get(os.path.splitext(audio_file)[1].lower(), "audio/mpeg"),
+        "tempo": float(tempo),
+        "keynote": keynote,
+        "keynote_root": keynote_root,
+        "chords": {
+            **chord_table(chord_names, keynote_root),
+            "ids": chord_ids,
+            "times": timestamps,
+            # bar 0 is the pickup before the first detected downbeat
+            "bars": [bisect.bisect_right(bar_times, timestamp) for timestamp in timestamps],
+        },
+        "tones": {
+            "names": tone_names,
+            "ids": tone_ids,
+            "times": [round(float(beat_time), 3) for beat_time, tone in tones_at_beats],
+        },
+    }
+
+def generate_html_with_chords(audio_file, chords, artist_name, song_title, tempo, beat_times, tones_at_beats, keynote,
+                              bar_times=None):
     sanitized_artist = sanitize_filename(artist_name)
     sanitized_title = sanitize_filename(song_title)
-    output_file_name = f"{sanitized_artist}_{sanitized_title}.html"
-
-    sanitized_audio_file = sanitize_url(audio_file)
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <link rel="icon" href="./favicon.ico" sizes="any">
-        <link rel="icon" href="./favicon.svg" type="image/svg+xml">
-        <meta charset="UTF-8">
-        <title>Chords from {artist_name} - {song_title}</title>
-        <script src="./engine/scripts/script.js"></script>
-        <link rel="stylesheet" type="text/css" href="./engine/scripts/style.css" />
-    </head>
-    <body>
-    <header>
-      <div>
-        <h4>File: {sanitized_audio_file}</h4>
-        <audio controls>
-          <source src="{sanitized_audio_file}" type="audio/mpeg" />
-          Your browser does not support the audio element.
-        </audio>
-        <label for="bpm-input">BPM:</label>
-        <input type="number" id="bpm-input" class="bpm-input" value="{tempo}" step="1" min="30" max="300" />
-        <button id="update-bpm">Update BPM</button>
-        <button id="vel-up">BPM(+)</button>
-        <button id="vel-down">BPM(-)</button>
-        <div>
-          <label for="keynote">Key:</label>
-          <input type="text" id="keynote" class="keynote" value="{keynote}"  />
-          <button id="transpose-up">Transpose Up (+)</button>
-          <button id="transpose-down">Transpose Down (-)</button><br></br>
-          Transpose: <span id="transpose-counter">0</span>, Capo:
-          <span id="capo-counter">0</span>
-          <input type="radio" id="guitar" name="instrument" value="guitar" checked />
-          <label for="guitar">Guitar</label>
-          <input type="radio" id="ukulele" name="instrument" value="ukulele" />
-          <label for="ukulele">Ukulele</label>
-        </div>
-        <div id="dark-mode-toggle">
-         <button id="toggle-dark-mode">Toggle Dark Mode</button>
-        </div>
-      </div>
-      <div id="chord-diagram-bar">
-        <img id="chord-diagram-current" src="./engine/diagrams/empty.png" />
-        <h1 id="chord-current"></h1>
-        <div style=" width: 2px; height: 100%; display: block; background: #8d94b4; margin: 15px; "></div>
-        <img id="chord-diagram-next" src="./engine/diagrams/empty.png" />
-        <h1 id="chord-next"></h1>
-      </div>
-    </header>
-    <button id="zoom-in">zoom-in(+)</button>
-    <button id="zoom-out">zoom-out(-)</button>
-    <ul id="chords">
-    """
-
-    for chord in chords:
-        timestamp = getattr(chord, 'timestamp', '0')
-        chord_name = getattr(chord, 'chord', 'Unknown')
-        html_content += f"<li id='{timestamp}'>{chord_name}</li>"
-
-    html_content += """
-        </ul>
-        <h2>Tones at Beats</h2>
-        <ul id="tones-at-beats">
-    """
-    for beat_time, tone in tones_at_beats:
-        html_content += f"<li>Time: {beat_time:.2f}s - Tone: {tone}</li>"
-
-    html_content += """
-        </ul>
-    </body>
-    </html>
-    """
-
-    html_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../', output_file_name)
+    output_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../')
+    html_file = os.path.join(output_dir, f"{sanitized_artist}_{sanitized_title}.html")
+    data_file = f"{sanitized_artist}_{sanitized_title}_data.js"
+
+    data = song_data(audio_file, chords, artist_name, song_title, tempo, tones_at_beats, keynote, bar_times)
+    with open(os.path.join(output_dir, data_file), "w", encoding="utf-8") as f:
+        f.write(f"var songData = {json_for_script(data)};\n")
+
     with open(html_file, "w", encoding="utf-8") as f:
-        f.write(html_content)
+        f.write(PAGE_TEMPLATE.substitute(artist=escape(artist_name), title=escape(song_title),
+                                         data_file=quote(data_file)))
 
     return html_file
@@ -0,0 +1,24 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+def bounded_map(submit, items, max_pending):
+    """Runs submit(item) for every item, with at most max_pending futures in flight at once, and yields
+    (item, result, error) as they complete; error is None, or the exception the item failed with, as text."""
+    items = iter(items)
+    pending = {}
+    while True:
+        # items are only drawn from the iterator as slots free up, so a generator is never read ahead
+        while len(pending) < max_pending:
+            item = next(items, None)
+            if item is None:
+                break
+            pending[submit(item)] = item
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, f"{type(e).__name__}: {e}"
@@ -0,0 +1,50 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "engine"))
+
+from download_youtube_audio import expand_urls
+
+CHANNEL = "https://www.youtube.com/@band"
+
+# what yt-dlp lists with extract_flat for a channel with videos, shorts and live tabs
+EXTRACTED = {
+    CHANNEL: {"_type": "playlist", "id": "UCband", "entries": [
+        {"_type": "url", "ie_key": "YoutubeTab", "url": f"{CHANNEL}/videos", "title": "Band - Videos"},
+        {"_type": "url", "ie_key": "YoutubeTab", "url": f"{CHANNEL}/shorts", "title": "Band - Shorts"},
+        {"_type": "playlist", "title": "Band - Live", "entries": [
+            {"_type": "url", "ie_key": "Youtube", "id": "live1", "title": "Band - Live at the Hall"},
+        ]},
+    ]},
+    f"{CHANNEL}/videos": {"_type": "playlist", "entries": [
+        {"_type": "url", "ie_key": "Youtube", "id": "vid1", "title": "Band - First Song"},
+        {"_type": "url", "ie_key": "Youtube", "id": "vid2", "title": "Second Song", "uploader": "Band"},
+        None,
+    ]},
+    f"{CHANNEL}/shorts": {"_type": "playlist", "entries": [
+        {"_type": "url", "ie_key": "Youtube", "id": "short1", "title": "Band - Riff"},
+        {"_type": "url", "ie_key": "Youtube", "id": "vid1", "title": "Band - First Song"},
+    ]},
+}
+
+class FakeYoutubeDL:
+    def __init__(self, options):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def extract_info(self, url, download=True):
+        return EXTRACTED[url]
+
+def test_expand_urls_lists_the_videos_of_every_channel_tab(monkeypatch):
+    monkeypatch.setitem(sys.modules, "yt_dlp", types.SimpleNamespace(YoutubeDL=FakeYoutubeDL))
+    songs = list(expand_urls([CHANNEL, "https://youtu.be/single"]))
+    assert [song["video_id"] for song in songs] == ["vid1", "vid2", "short1", "live1", "single"]
+    assert songs[0] == {"url": "https://www.youtube.com/watch?v=vid1", "video_id": "vid1",
+                        "artist": "Band", "title": "First Song"}
+    assert (songs[1]["artist"], songs[1]["title"]) == ("Band", "Second Song")